@@ -3,16 +3,152 @@ import re
 import time
 import datetime
 import httpx
-import imaplib
 import email
 import sys
+import zoneinfo
+from array import array
+
+import aioimaplib
+
+from .const import (
+    ACCOUNT_METADATA_MAX_AGE,
+    API_CONNECT_TIMEOUT,
+    API_KEEPALIVE_EXPIRY,
+    API_MAX_CONNECTIONS,
+    API_MAX_KEEPALIVE_CONNECTIONS,
+    API_READ_TIMEOUT,
+    API_SESSION_MAX_AGE,
+    API_USAGE_DATA_READ_TIMEOUT,
+    IMAP_IDLE_TIMEOUT,
+    IMAP_POLL_INTERVAL,
+    IMAP_TIMEOUT,
+)
+from .jsonstream import DecodeError, IntervalDataDecoder
+from .series import ENGINE_AUTO, IntervalSeries
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_SUPPORTED = True
+except ImportError:
+    HTTP2_SUPPORTED = False
+
+BASE_URL = "https://selfserve.synergy.net.au/apps/rest"
+
+# Synergy only serves Western Australia, interval data is in Perth local time
+SYNERGY_TIMEZONE = zoneinfo.ZoneInfo("Australia/Perth")
+
+USAGE_DATA_COLUMNS = {
+    "peak_kwh": "peakKwhHalfHourlyValues",
+    "off_peak_kwh": "offpeakKwhHalfHourlyValues",
+    "kw": "kwHalfHourlyValues",
+    "kva": "kvaHalfHourlyValues",
+    "power_factor": "powerFactorHalfHourlyValues",
+    "load_factor": "loadFactorHalfHourlyValues",
+    "generation_kwh": "kwhHalfHourlyValuesGeneration",
+}
+
+DEFAULT_TIMEOUT = httpx.Timeout(API_READ_TIMEOUT, connect=API_CONNECT_TIMEOUT)
+USAGE_DATA_TIMEOUT = httpx.Timeout(API_USAGE_DATA_READ_TIMEOUT, connect=API_CONNECT_TIMEOUT)
+
+
+OTP_EMAIL_SUBJECT = "Your Synergy One-time Passcode"
+
 
 class AddressError(Exception):
     pass
 
-def get_premise_id(address):
-    url = f"https://selfserve.synergy.net.au/apps/rest/addressSearch/searchPremise.json?query={address}"
-    response = httpx.post(url)
+
+class SessionExpiredError(Exception):
+    pass
+
+
+class InvalidAccountMetadataError(Exception):
+    pass
+
+
+class ContractAccountNotFoundError(Exception):
+    pass
+
+
+def create_transport():
+    """Build the pooled keep-alive transport shared by every fetcher.
+
+    Building the SSL context is blocking, call this from an executor when running
+    inside an event loop.
+    """
+    return httpx.AsyncHTTPTransport(
+        http2=HTTP2_SUPPORTED,
+        limits=httpx.Limits(
+            max_connections=API_MAX_CONNECTIONS,
+            max_keepalive_connections=API_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=API_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+def create_client(transport=None):
+    # Each client keeps its own cookie jar (the selfserve session) but all of them
+    # share the same connection pool. httpx negotiates gzip/deflate (and brotli
+    # when available) on its own.
+    return httpx.AsyncClient(
+        transport=transport or create_transport(),
+        timeout=DEFAULT_TIMEOUT,
+    )
+
+
+def _local_midnight(day):
+    # Intervals are returned from local midnight of the start date
+    return int(datetime.datetime.combine(day, datetime.time.min, tzinfo=SYNERGY_TIMEZONE).timestamp())
+
+
+def _build_series(usage_data, start, engine=ENGINE_AUTO):
+    # Columns were already decoded into arrays while streaming the response
+    length = len(next(iter(usage_data.values()))[0])
+    columns = {}
+    masks = {}
+    for name, key in USAGE_DATA_COLUMNS.items():
+        if key in usage_data:
+            columns[name], masks[name] = usage_data[key]
+        else:
+            # Not reported at all (ex. no generation), nothing is valid
+            columns[name], masks[name] = array('d', bytes(8 * length)), array('B', bytes(length))
+
+    series = IntervalSeries(start, columns, masks)
+    series.add_sum_column("total_kwh", "peak_kwh", "off_peak_kwh", engine=engine)
+    series.add_difference_column("net_kwh", "total_kwh", "generation_kwh", engine=engine)
+
+    return series
+
+
+def _check_session(response):
+    # An expired selfserve session answers with 401 or redirects to the login page
+    if response.status_code == 401 or response.is_redirect:
+        raise SessionExpiredError(f"Session expired. Status code: {response.status_code}")
+
+
+def _extract_email_token(raw_email):
+    # Decode the email content
+    msg = email.message_from_bytes(raw_email)
+
+    if msg.is_multipart():
+        bodies = [part.get_payload(decode=True) for part in msg.walk() if part.get_content_type() == "text/plain"]
+    else:
+        bodies = [msg.get_payload(decode=True)]
+
+    for body in bodies:
+        # Extract a 6-digit email token using regular expression
+        match = re.search(r'>(\d{6})<', body.decode("utf-8"))
+        if match:
+            return match.group(1)
+
+    return None
+
+
+async def get_premise_id(address, client=None):
+    url = f"{BASE_URL}/addressSearch/searchPremise.json"
+    client = client or create_client()
+    response = await client.post(url, params={"query": address})
 
     if response.status_code == 200:
         json_data = response.json()
@@ -31,218 +167,483 @@ def get_premise_id(address):
         raise Exception(f"Error: {response.status_code}. Failed to fetch data.")
 
 
+class SynergySession:
+    """Selfserve login (cookies and Allow-Contract header) of an email address.
+
+    A login gives access to every contract account of the email address, so the
+    fetchers of all its premises can share the same session (and login once).
+    """
+
+    def __init__(self, transport=None):
+        # Don't close this client, closing it would close the shared transport too
+        self.client = create_client(transport)
+        self.allow_contract = None
+        self.expires = None
+        # Held while logging in, so fetchers sharing the session don't login twice
+        self.lock = asyncio.Lock()
+
+    @property
+    def is_valid(self):
+        return self.expires is not None and time.time() < self.expires
+
+    def export(self):
+        """Return the session as a JSON serializable dict."""
+        if not self.is_valid:
+            return None
+
+        return {
+            "cookies": [
+                {"name": cookie.name, "value": cookie.value, "domain": cookie.domain, "path": cookie.path}
+                for cookie in self.client.cookies.jar
+            ],
+            "allow_contract": self.allow_contract,
+            "expires": self.expires,
+        }
+
+    def restore(self, session):
+        """Restore a session previously returned by export(), unless it's older than the current one."""
+        if not session or session.get("expires", 0) <= time.time():
+            return
+
+        if self.is_valid and self.expires >= session["expires"]:
+            return
+
+        self.client.cookies.clear()
+        for cookie in session["cookies"]:
+            self.client.cookies.set(cookie["name"], cookie["value"], domain=cookie["domain"], path=cookie["path"])
+
+        self.set(session.get("allow_contract"), session["expires"])
+
+    def invalidate(self):
+        self.client.cookies.clear()
+        self.client.headers.pop("Allow-Contract", None)
+        self.allow_contract = None
+        self.expires = None
+
+    def set(self, allow_contract, expires):
+        self.allow_contract = allow_contract
+        self.expires = expires
+        if allow_contract:
+            self.client.headers["Allow-Contract"] = allow_contract
+
+
 class SynergyDataFetcher:
-    def __init__(self, premise_id, email_address, password, email_server, email_port=993, usage_data=None):
+    def __init__(self, premise_id, email_address, password, email_server, email_port=993, usage_data=None,
+                 transport=None, imap_ssl_context=None, session=None):
         self.premise_id = premise_id
         self.email_address = email_address
         self.password = password
         self.email_server = email_server
         self.email_port = email_port
         self._usage_data = usage_data
-        self._client = httpx.Client()
-
-    async def fetch(self, start_date, end_date=datetime.date.today()):
-        login_email_response = self._send_email_token()
-        if login_email_response.status_code == 200:
-            email_token = await self._get_email_token()
-            if email_token:
-                login_response = self._login_with_email_token(email_token,
-                                                              login_email_response.headers.get("Allow-Contract"))
-                if login_response.status_code == 200:
-                    print("Login successful!")
-                    contract_account_number = self._get_contract_account_number()
-                    if contract_account_number:
-                        device_id = self._get_device_id(contract_account_number)
-                        if device_id:
-                            self._usage_data = self._get_usage_data(contract_account_number, device_id, start_date,
-                                                                    end_date)
-
-                            start_time = datetime.datetime.combine(start_date, datetime.datetime.min.time())
-                            self._usage_data["timestamps"] = []
-                            for ii in range(0, len(self._usage_data['kwHalfHourlyValues'])):
-                                self._usage_data["timestamps"].append(start_time)
-                                start_time += datetime.timedelta(minutes=30)
-
-                            return self._usage_data
-                else:
-                    raise Exception("Failed to login with email token.")
-        elif login_email_response.status_code == 400 and "you have had too many attempts" in login_email_response.text:
-            raise Exception("Too many attempts, try again tomorrow.")
-        else:
-            raise Exception(f"Web server response did not meet expected conditions. {login_email_response.status_code}")
+        self._usage_start = None
+        self._session = session or SynergySession(transport)
+        self._imap_ssl_context = imap_ssl_context
+        self._account_metadata = {}
+        # Parallel requests (ex. several devices) must not refetch metadata at once
+        self._account_metadata_lock = asyncio.Lock()
+
+    @property
+    def _client(self):
+        return self._session.client
+
+    @property
+    def session_lock(self):
+        return self._session.lock
+
+    @property
+    def has_session(self):
+        return self._session.is_valid
+
+    def export_session(self):
+        """Return the current selfserve session as a JSON serializable dict."""
+        return self._session.export()
+
+    def restore_session(self, session):
+        """Restore a session previously returned by export_session()."""
+        self._session.restore(session)
+
+    def invalidate_session(self):
+        self._session.invalidate()
+
+    def _set_session(self, allow_contract, expires):
+        self._session.set(allow_contract, expires)
+
+    async def fetch(self, start_date, end_date=None):
+        end_date = end_date or datetime.date.today()
+
+        if self.has_session:
+            try:
+                return await self._fetch_usage_data(start_date, end_date)
+            except SessionExpiredError:
+                print("Session expired, login again")
+                self.invalidate_session()
+
+        if not await self._login():
+            return None
+
+        return await self._fetch_usage_data(start_date, end_date)
+
+    async def ensure_session(self):
+        """Login if there is no usable session and load the account metadata.
+
+        Returns False if the email token didn't arrive.
+        """
+        if self.has_session:
+            try:
+                return await self._get_account_metadata() is not None
+            except SessionExpiredError:
+                print("Session expired, login again")
+                self.invalidate_session()
+
+        if not await self._login():
+            return False
+
+        return await self._get_account_metadata() is not None
+
+    async def fetch_series(self, start_date, end_date, engine=ENGINE_AUTO, device_id=None):
+        """Fetch and parse a date range of an interval device (the first one by
+        default) using the current session.
+
+        Unlike fetch() this never logs in and doesn't change the state used by
+        parse(), so it is safe to run several of them at the same time. Raises
+        SessionExpiredError (and forgets the session) if it is no longer valid,
+        call ensure_session() before trying again.
+        """
+        try:
+            usage_data = await self._request_usage_data(start_date, end_date, device_id)
+        except SessionExpiredError:
+            self.invalidate_session()
+            raise
+
+        if usage_data is None:
+            return None
+
+        return _build_series(usage_data, _local_midnight(start_date), engine)
+
+    async def _login(self):
+        # Get the IMAP session ready while Synergy is still sending the email
+        imap_connect_task = asyncio.create_task(self._imap_connect())
+        try:
+            login_email_response = await self._send_email_token()
+        except BaseException:
+            imap_connect_task.cancel()
+            raise
+
+        if login_email_response.status_code != 200:
+            imap_connect_task.cancel()
+            if login_email_response.status_code == 400 and "you have had too many attempts" in login_email_response.text:
+                raise Exception("Too many attempts, try again tomorrow.")
+            else:
+                raise Exception(
+                    f"Web server response did not meet expected conditions. {login_email_response.status_code}")
 
-    def parse(self):
-        if not self._usage_data:
-            raise ValueError("Usage data has not been fetched yet. Please call retch() first.")
+        mail = await imap_connect_task
+        try:
+            email_token = await self._get_email_token(mail)
+        finally:
+            await self._imap_logout(mail)
+
+        if not email_token:
+            return False
 
-        usage_data = self._usage_data
+        allow_contract = login_email_response.headers.get("Allow-Contract")
+        login_response = await self._login_with_email_token(email_token, allow_contract)
+        if login_response.status_code != 200:
+            raise Exception("Failed to login with email token.")
 
-        peak_kwh = [value if value is not None else 0 for value in usage_data['peakKwhHalfHourlyValues']]
-        off_peak_kwh = [value if value is not None else 0 for value in usage_data['offpeakKwhHalfHourlyValues']]
-        kw = [value if value is not None else 0 for value in usage_data['kwHalfHourlyValues']]
-        kva = [value if value is not None else 0 for value in usage_data['kvaHalfHourlyValues']]
-        power_factor = [value if value is not None else 0 for value in usage_data['powerFactorHalfHourlyValues']]
-        load_factor = [value if value is not None else 0 for value in usage_data['loadFactorHalfHourlyValues']]
-        generation_kwh = [value if value is not None else 0 for value in usage_data['kwhHalfHourlyValuesGeneration']]
+        print("Login successful!")
 
-        total_kwh = [x + y for x, y in zip(peak_kwh, off_peak_kwh)]
+        # Trust cookie expiration if the server sends it, otherwise assume a conservative lifetime
+        expires = time.time() + API_SESSION_MAX_AGE.total_seconds()
+        cookie_expires = [cookie.expires for cookie in self._client.cookies.jar if cookie.expires]
+        if cookie_expires:
+            expires = min(expires, *cookie_expires)
 
-        parsed_usage_data = self._build_data_list(
-            ["timestamp", "peak_kwh", "off_peak_kwh", "kw", "kva", "power_factor", "load_factor", "generation_kwh", "total_kwh"],
-            usage_data["timestamps"], peak_kwh, off_peak_kwh, kw, kva, power_factor, load_factor, generation_kwh, total_kwh)
+        self._set_session(allow_contract, expires)
+        return True
 
-        return parsed_usage_data
+    async def _fetch_usage_data(self, start_date, end_date):
+        usage_data = await self._request_usage_data(start_date, end_date)
+        if usage_data is None:
+            return None
 
-    def _send_email_token(self):
+        self._usage_data = usage_data
+        self._usage_start = _local_midnight(start_date)
+
+        return self._usage_data
+
+    async def _request_usage_data(self, start_date, end_date, device_id=None, refreshed=False):
+        metadata = await self._get_account_metadata()
+        if not metadata:
+            return None
+
+        try:
+            return await self._get_usage_data(metadata["contract_account_number"],
+                                              device_id or metadata["device_ids"][0], start_date, end_date)
+        except InvalidAccountMetadataError:
+            if not metadata["cached"] or refreshed:
+                raise
+
+            # Account or devices changed since they were cached, get them again. Only
+            # once, other requests could have already refreshed them
+            async with self._account_metadata_lock:
+                current = self._account_metadata.get(self.premise_id)
+                if current and current["fetched_at"] == metadata["fetched_at"]:
+                    print("Account metadata is outdated, fetching it again")
+                    self.invalidate_account_metadata()
+
+            return await self._request_usage_data(start_date, end_date, device_id, refreshed=True)
+
+    def export_account_metadata(self):
+        """Return the cached account metadata as a JSON serializable dict."""
+        return dict(self._account_metadata)
+
+    def restore_account_metadata(self, account_metadata):
+        self._account_metadata = dict(account_metadata or {})
+
+    def invalidate_account_metadata(self):
+        self._account_metadata.pop(self.premise_id, None)
+
+    @property
+    def device_id(self):
+        """Interval device used for usage data, None until account metadata is known."""
+        metadata = self._account_metadata.get(self.premise_id)
+        if not metadata:
+            return None
+
+        return metadata["device_ids"][0]
+
+    @property
+    def device_ids(self):
+        """Every interval device of the premise (ex. solar or controlled load meters),
+        empty until account metadata is known."""
+        metadata = self._account_metadata.get(self.premise_id)
+        if not metadata:
+            return []
+
+        return list(metadata["device_ids"])
+
+    @property
+    def contract_accounts(self):
+        """Every contract account of the login, empty until account metadata is known."""
+        metadata = self._account_metadata.get(self.premise_id)
+        if not metadata:
+            return []
+
+        return metadata.get("contract_accounts", [])
+
+    async def _get_account_metadata(self):
+        async with self._account_metadata_lock:
+            return await self._get_account_metadata_unlocked()
+
+    async def _get_account_metadata_unlocked(self):
+        metadata = self._account_metadata.get(self.premise_id)
+        # Metadata cached by older versions lacks the contract accounts
+        if (metadata and "contract_accounts" in metadata
+                and time.time() - metadata["fetched_at"] < ACCOUNT_METADATA_MAX_AGE.total_seconds()):
+            return metadata | {"cached": True}
+
+        contract_accounts = await self._get_contract_accounts()
+        contract_account_number = self._get_contract_account_number(contract_accounts)
+        if not contract_account_number:
+            return None
+
+        installation_details = await self._get_installation_details(contract_account_number)
+        device_ids = [device['deviceId'] for device in installation_details['intervalDevices'] if device['deviceId']]
+        if not device_ids:
+            return None
+
+        metadata = {
+            "contract_account_number": contract_account_number,
+            "device_ids": device_ids,
+            "installation_details": installation_details,
+            "contract_accounts": contract_accounts,
+            "fetched_at": time.time(),
+        }
+        self._account_metadata[self.premise_id] = metadata
+
+        return metadata | {"cached": False}
+
+    def parse(self, engine=ENGINE_AUTO):
+        """Return fetched data as an IntervalSeries.
+
+        Derived columns use numpy if available, `engine="python"` forces the pure
+        python engine.
+        """
+        if not self._usage_data:
+            raise ValueError("Usage data has not been fetched yet. Please call fetch() first.")
+
+        return _build_series(self._usage_data, self._usage_start, engine)
+
+    async def _send_email_token(self):
         print("Sending email token")
-        login_url = "https://selfserve.synergy.net.au/apps/rest/emailLogin/getEmailToken"
+        login_url = f"{BASE_URL}/emailLogin/getEmailToken"
         login_payload = {'emailAddress': self.email_address, 'premiseId': self.premise_id}
-        login_response = self._client.post(login_url, data=login_payload)
+        login_response = await self._client.post(login_url, data=login_payload)
         return login_response
 
-    async def _get_email_token(self, timeout=180):
-        print("Get email token")
-        start_time = time.time()  # Record the start time
-        while time.time() - start_time < timeout:
-            # Connect to the IMAP server
-            mail = imaplib.IMAP4_SSL(self.email_server, self.email_port)
-            mail.login(self.email_address, self.password)
-            mail.select("inbox")
-            # Check if the timeout has occurred
-            if time.time() - start_time > timeout:
-                print("Timeout occurred. No email token received.")
-                break
-
-            # Search for emails with a specific subject
-            status, messages = mail.search(None, '(UNSEEN SUBJECT "Your Synergy One-time Passcode")')  #UNSEEN
+    async def _imap_connect(self):
+        print("Connecting to email server")
+        mail = aioimaplib.IMAP4_SSL(self.email_server, self.email_port, timeout=IMAP_TIMEOUT,
+                                    ssl_context=self._imap_ssl_context)
+        await mail.wait_hello_from_server()
 
-            if messages[0]:
-                # Get the latest email ID
-                latest_email_id = messages[0].split()[-1]
+        response = await mail.login(self.email_address, self.password)
+        if response.result != "OK":
+            raise Exception("Failed to login to the email server.")
 
-                # Fetch the email content
-                _, msg_data = mail.fetch(latest_email_id, '(RFC822)')
-                raw_email = msg_data[0][1]
+        response = await mail.select("INBOX")
+        if response.result != "OK":
+            raise Exception("Failed to select the email inbox.")
 
-                # Decode the email content
-                msg = email.message_from_bytes(raw_email)
+        return mail
 
-                email_token = None
+    async def _imap_logout(self, mail):
+        try:
+            await mail.logout()
+        except (asyncio.TimeoutError, aioimaplib.Abort, aioimaplib.CommandTimeout, OSError):
+            pass
 
-                if msg.is_multipart():
-                    for part in msg.walk():
-                        if part.get_content_type() == "text/plain":
-                            body = part.get_payload(decode=True).decode("utf-8")
-                            # print(body)
-
-                            # Extract a 6-digit email token using regular expression
-                            match = re.search(r'>(\d{6})<', body)
-                            if match:
-                                email_token = match.group(1)  # print(f"Email Token: {email_token}")
-                else:
-                    body = msg.get_payload(decode=True).decode("utf-8")
-                    # print(body)
+    async def _get_email_token(self, mail, timeout=180):
+        print("Get email token")
+        deadline = time.monotonic() + timeout
+        while (remaining := deadline - time.monotonic()) > 0:
+            # Search for emails with a specific subject
+            response = await mail.search(f'UNSEEN SUBJECT "{OTP_EMAIL_SUBJECT}"', charset=None)
+            messages = response.lines[0].split() if response.result == "OK" else []
 
-                    # Extract a 6-digit email token using regular expression
-                    match = re.search(r'>(\d{6})<', body)
-                    if match:
-                        email_token = match.group()  # print(f"Email Token: {email_token}")
+            if messages:
+                # Fetch the latest email content, this also flags it as seen
+                latest_email_id = messages[-1].decode()
+                response = await mail.fetch(latest_email_id, '(RFC822)')
+                email_token = _extract_email_token(bytes(response.lines[1]))
 
                 # Print the extracted email token
                 if email_token:
                     print(f"Email Token: {email_token}")
-                    mail.logout()
                     return email_token
                 else:
                     print("No email token found.")
+
+            elif mail.has_capability("IDLE"):
+                print("No unread emails with email token. Waiting for new emails...")
+                # Let the server push new messages instead of polling
+                idle = await mail.idle_start(timeout=min(remaining, IMAP_IDLE_TIMEOUT))
+                try:
+                    await mail.wait_server_push(timeout=min(remaining, IMAP_IDLE_TIMEOUT))
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    mail.idle_done()
+                    await asyncio.wait_for(idle, IMAP_TIMEOUT)
+
             else:
                 print("No unread emails with email token. Waiting for new emails...")
-                await asyncio.sleep(10)  # Adjust the interval as needed
+                await asyncio.sleep(min(remaining, IMAP_POLL_INTERVAL))
 
         print("Timeout reached. No email token received within the specified duration.")
-        mail.logout()
         return None
 
-    def _login_with_email_token(self, email_token, allow_contract):
+    async def _login_with_email_token(self, email_token, allow_contract):
         print("Login with email token")
-        login_url = "https://selfserve.synergy.net.au/apps/rest/emailLogin/loginWithEmailToken"
+        login_url = f"{BASE_URL}/emailLogin/loginWithEmailToken"
         login_payload = {'emailToken': email_token}
-        login_response = self._client.post(login_url, json=login_payload,
-                                       headers={'Content-Type': 'application/json', 'Allow-Contract': allow_contract})
+        login_response = await self._client.post(login_url, json=login_payload,
+                                                 headers={'Content-Type': 'application/json',
+                                                          'Allow-Contract': allow_contract})
         return login_response
 
-    def _get_contract_account_number(self):
-        print("Getting contract account number")
-        index_json_url = "https://selfserve.synergy.net.au/apps/rest/account/index.json"
-        index_json_response = self._client.get(index_json_url)
+    async def _get_contract_accounts(self):
+        print("Getting contract accounts")
+        index_json_url = f"{BASE_URL}/account/index.json"
+        index_json_response = await self._client.get(index_json_url)
+        _check_session(index_json_response)
         if index_json_response.status_code == 200:
             json_data = index_json_response.json()
-            contract_account_number = json_data[0]['contractAccountNumber']
-            if contract_account_number:
-                print(f"Contract Account Number: {contract_account_number}")
-                return contract_account_number
+            contract_accounts = [
+                {"contract_account_number": account['contractAccountNumber'], "premise_id": account.get('premiseId')}
+                for account in json_data
+                if account.get('contractAccountNumber')
+            ]
+            if contract_accounts:
+                print(f"Contract Accounts: {contract_accounts}")
+                return contract_accounts
             else:
                 raise Exception("Contract Account Number not found in response JSON.")
         else:
             raise Exception(
                 f"Failed to retrieve contract account number. Status code: {index_json_response.status_code}")
 
-    def _get_device_id(self, contract_account_number):
-        print("Getting device ID")
-        account_json_url = f"https://selfserve.synergy.net.au/apps/rest/account/{contract_account_number}/show.json"
-        account_json_response = self._client.get(account_json_url)
+    def _get_contract_account_number(self, contract_accounts):
+        # Pick the account of our premise, the login may give access to several
+        for account in contract_accounts:
+            if account["premise_id"] is not None and str(account["premise_id"]) == str(self.premise_id):
+                contract_account_number = account["contract_account_number"]
+                break
+        else:
+            # Guessing would record the usage of another premise
+            if len(contract_accounts) > 1:
+                raise ContractAccountNotFoundError(
+                    f"No contract account found for premise {self.premise_id} "
+                    f"among {[account['contract_account_number'] for account in contract_accounts]}")
+            contract_account_number = contract_accounts[0]["contract_account_number"]
+
+        print(f"Contract Account Number: {contract_account_number}")
+        return contract_account_number
+
+    async def _get_installation_details(self, contract_account_number):
+        print("Getting installation details")
+        account_json_url = f"{BASE_URL}/account/{contract_account_number}/show.json"
+        account_json_response = await self._client.get(account_json_url)
+        _check_session(account_json_response)
         if account_json_response.status_code == 200:
             json_data = account_json_response.json()
-            device_id = json_data['installationDetails']['intervalDevices'][0]['deviceId']
-            if device_id:
-                print(f"Device ID: {device_id}")
-                return device_id
+            installation_details = json_data.get('installationDetails')
+            if installation_details and installation_details.get('intervalDevices'):
+                print(f"Device IDs: {[device['deviceId'] for device in installation_details['intervalDevices']]}")
+                return installation_details
             else:
                 raise Exception("Device ID not found in response JSON.")
         else:
             raise Exception(f"Failed to retrieve device ID. Status code: {account_json_response.status_code}")
 
-    def _get_usage_data(self, contract_account_number, device_id, start_date, end_date):
+    async def _get_usage_data(self, contract_account_number, device_id, start_date, end_date):
         print("Getting usage data")
-        usage_json_url = (f'https://selfserve.synergy.net.au/apps/rest/intervalData/'
-                          f'{contract_account_number}/getHalfHourlyElecIntervalData?intervalDeviceIds={device_id}&startDate={start_date.strftime("%Y-%m-%d")}&endDate='
-                          f'{end_date.strftime("%Y-%m-%d")}')
-        usage_json_response = self._client.get(usage_json_url)
-        if usage_json_response.status_code == 200:
-            json_data = usage_json_response.json()
-            if json_data:
-                print(f"Usage Data: {json_data}")
-                return json_data
+        usage_json_url = f"{BASE_URL}/intervalData/{contract_account_number}/getHalfHourlyElecIntervalData"
+        usage_json_params = {
+            "intervalDeviceIds": device_id,
+            "startDate": start_date.strftime("%Y-%m-%d"),
+            "endDate": end_date.strftime("%Y-%m-%d"),
+        }
+        async with self._client.stream("GET", usage_json_url, params=usage_json_params,
+                                       timeout=USAGE_DATA_TIMEOUT) as usage_json_response:
+            _check_session(usage_json_response)
+            if usage_json_response.status_code == 200:
+                # Decode the columns while the body is being received, large date ranges
+                # are never held in memory as text or as a parsed JSON document
+                decoder = IntervalDataDecoder(USAGE_DATA_COLUMNS.values())
+                async for chunk in usage_json_response.aiter_bytes():
+                    decoder.feed(chunk)
+
+                try:
+                    usage_data = decoder.close()
+                except DecodeError as e:
+                    raise Exception(f"Usage data not found in response JSON. {e}") from e
+
+                print(f"Usage Data: {len(next(iter(usage_data.values()))[0])} intervals")
+                return usage_data
+            elif 400 <= usage_json_response.status_code < 500:
+                raise InvalidAccountMetadataError(
+                    f"Failed to retrieve usage data. Status code: {usage_json_response.status_code}")
             else:
-                raise Exception("Device ID not found in response JSON.")
-        else:
-            raise Exception(f"Failed to retrieve usage data. Status code: {usage_json_response.status_code}")
-
-    def _build_data_list(self, key_names, *value_lists):
-        # Check if lengths of input lists are consistent
-        lengths = set(len(lst) for lst in value_lists)
-        if len(lengths) != 1:
-            raise ValueError("Lengths of input lists must be the same")
-
-        if len(value_lists) != len(key_names):
-            raise ValueError("Keys and values must have the same length")
-
-        # Initialize an empty dictionary
-        result_list = []
-
-        # Iterate over timestamps and value lists simultaneously using zip
-        for values in zip(*value_lists):
-            value_dict = {}
-            for key_name, value in zip(key_names, values):
-                value_dict[key_name] = value
-            result_list.append(value_dict)
-
-        return result_list
+                raise Exception(f"Failed to retrieve usage data. Status code: {usage_json_response.status_code}")
 
 
 if __name__ == "__main__":
     if len(sys.argv) < 6:
-        print("Usage: python script.py <premise_id> <email_address> <password> <email_server> <email_port>")
+        print("Usage: python -m custom_components.synergy.SynergyDataFetcher "
+              "<premise_id> <email_address> <password> <email_server> <email_port> [<start_date> [<end_date>]]")
         sys.exit(1)
 
     premise_id = sys.argv[1]
@@ -277,7 +678,20 @@ if __name__ == "__main__":
         print("Error: email_port must be a non-empty integer.")
         sys.exit(1)
 
-    synergy_fetcher = SynergyDataFetcher(premise_id, email_address, password, email_server, email_port)
-    synergy_fetcher.fetch(datetime.date.today() - datetime.timedelta(days=2))
-    parsed_usage_data = synergy_fetcher.parse()
+    try:
+        start_date = (datetime.date.fromisoformat(sys.argv[6]) if len(sys.argv) > 6
+                      else datetime.date.today() - datetime.timedelta(days=2))
+        end_date = datetime.date.fromisoformat(sys.argv[7]) if len(sys.argv) > 7 else datetime.date.today()
+    except ValueError:
+        print("Error: start_date and end_date must be YYYY-MM-DD dates.")
+        sys.exit(1)
+
+    async def main():
+        # Same chunked engine used by the synergy.backfill service
+        from .backfill import BackfillEngine
+
+        synergy_fetcher = SynergyDataFetcher(premise_id, email_address, password, email_server, email_port)
+        return await BackfillEngine(synergy_fetcher).run(start_date, end_date)
+
+    parsed_usage_data = asyncio.run(main())
     print(parsed_usage_data)
@@ -19,56 +19,103 @@
 import asyncio
 import logging
 import math
+import shutil
 from datetime import timedelta
+from pathlib import Path
 
-from .SynergyDataFetcher import SynergyDataFetcher
-from homeassistant.config_entries import ConfigEntry
-from homeassistant.const import CONF_EMAIL, CONF_PASSWORD, CONF_HOST, CONF_PORT
-from homeassistant.core import HomeAssistant
+from .SynergyDataFetcher import SynergyDataFetcher, SynergySession, create_transport
+from homeassistant.config_entries import SOURCE_INTEGRATION_DISCOVERY, ConfigEntry
+from homeassistant.const import (
+    CONF_EMAIL,
+    CONF_HOST,
+    CONF_PASSWORD,
+    CONF_PORT,
+    EVENT_HOMEASSISTANT_CLOSE,
+)
+from homeassistant.core import Event, HomeAssistant, callback
 from homeassistant.exceptions import ConfigEntryNotReady
+from homeassistant.helpers import config_validation as cv, discovery_flow
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
 from homeassistant.helpers.entity import DeviceInfo
+from homeassistant.helpers.storage import STORAGE_DIR
+from homeassistant.util.ssl import client_context
 
 from .barrier import TimeDeltaBarrier, TimeWindowBarrier  # NoopBarrier,
 from .const import (
     API_USER_SESSION_TIMEOUT,
+    CACHE_DIRECTORY,
     CONF_PREMISE_ID,
+    CONF_REVISION_OVERLAP,
+    DATA_SESSIONS,
+    DATA_TRANSPORT,
+    DEFAULT_REVISION_OVERLAP,
     DOMAIN,
+    HISTORY_DIRECTORY,
     MAX_RETRIES,
     MIN_SCAN_INTERVAL,
+    STORAGE_KEY_ACCOUNT_METADATA,
+    STORAGE_KEY_BARRIER,
+    STORAGE_KEY_SESSION,
     UPDATE_WINDOW_END_MINUTE,
     UPDATE_WINDOW_START_MINUTE,
 )
 from .datacoordinator import DataSetType, SynergyCoordinator
+from .laststatistics import async_track_statistics_imports
+from .scheduler import FetchScheduler
+from .services import async_setup_services
+from .storage import SynergyStorage
 from .updates import update_integration
 
 PLATFORMS: list[str] = ["sensor"]
 
+CONFIG_SCHEMA = cv.config_entry_only_config_schema(DOMAIN)
+
 _LOGGER = logging.getLogger(__name__)
 
 
+async def async_setup(hass: HomeAssistant, config: dict) -> bool:
+    async_setup_services(hass)
+    async_track_statistics_imports(hass)
+    return True
+
+
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
-    api = SynergyAPI(entry)
+    # Premises of the same account share the login, N premises need one OTP email
+    api = SynergyAPI(entry, session=await async_get_session(hass, entry.data[CONF_EMAIL]))
+
+    storage = SynergyStorage(hass, entry.entry_id)
+    await storage.async_load()
+    # Reuse the last selfserve session, if still alive, to skip the OTP login
+    api.restore_session(storage.get(STORAGE_KEY_SESSION))
+    api.restore_account_metadata(storage.get(STORAGE_KEY_ACCOUNT_METADATA))
 
     device_info = SynergyDeviceInfo(entry.data[CONF_PREMISE_ID])
 
+    # Keep barrier state across restarts, or restarting within the update window
+    # would login (and send an OTP email) again
+    barrier = TimeWindowBarrier(
+        allowed_window_hours=(0, 1),
+        max_retries=1,
+        max_age=timedelta(days=2),
+        on_change=lambda state: storage.set(STORAGE_KEY_BARRIER, state),
+    )
+    barrier.restore(storage.get(STORAGE_KEY_BARRIER))
+
     coordinator = SynergyCoordinator(
         hass=hass,
         api=api,
-        barrier=TimeWindowBarrier(
-                allowed_window_hours=(0, 1),
-                max_retries=1,
-                max_age=timedelta(days=2)
-            ),
-        # Use default update_interval and relay on barriers for now
-        # MEASURE barrier should deny if last attempt (success or not) is too recent to
-        # prevent api smashing or subsequent baning
-        # update_interval=_calculate_datacoordinator_update_interval(),
-        update_interval=timedelta(minutes=10),
+        barrier=barrier,
+        storage=storage,
+        cache_path=get_cache_path(hass),
+        history_path=get_history_path(hass),
+        # Don't poll, FetchScheduler refreshes when the barrier allows it
+        update_interval=None,
+        revision_overlap=_get_revision_overlap(entry),
     )
 
     # Don't refresh coordinator yet since there isn't any sensor registered
     # await coordinator.async_refresh()
+    await coordinator.async_restore_data()
 
     if not coordinator.last_update_success:
         raise ConfigEntryNotReady
@@ -76,6 +123,18 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     hass.data[DOMAIN] = hass.data.get(DOMAIN, {})
     hass.data[DOMAIN][entry.entry_id] = (coordinator, device_info)
 
+    scheduler = FetchScheduler(hass, coordinator, entry.data[CONF_PREMISE_ID])
+    scheduler.async_start()
+    entry.async_on_unload(scheduler.async_stop)
+
+    # Contract accounts are known after the first login, offer the other premises
+    async_discover_premises(hass, entry, api)
+    entry.async_on_unload(
+        coordinator.async_add_listener(
+            lambda: async_discover_premises(hass, entry, api)
+        )
+    )
+
     for platform in PLATFORMS:
         if entry.options.get(platform, True):
             coordinator.platforms.append(platform)
@@ -83,7 +142,7 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
                 hass.config_entries.async_forward_entry_setup(entry, platform)
             )
 
-    entry.async_on_unload(entry.add_update_listener(async_reload_entry))
+    entry.async_on_unload(entry.add_update_listener(async_update_options))
 
     return True
 
@@ -101,13 +160,43 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     )
     if unloaded:
         hass.data[DOMAIN].pop(entry.entry_id)
+        await coordinator.async_close()
+        # A reload loads the storage again, delayed writes would be lost
+        await coordinator.storage.async_flush()
 
     return unloaded
 
 
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    await SynergyStorage(hass, entry.entry_id).async_remove()
+    for path in (get_cache_path(hass), get_history_path(hass)):
+        await hass.async_add_executor_job(
+            shutil.rmtree, path / str(entry.data[CONF_PREMISE_ID]), True
+        )
+
+
+def _get_revision_overlap(entry: ConfigEntry) -> timedelta:
+    return timedelta(
+        days=entry.options.get(CONF_REVISION_OVERLAP, DEFAULT_REVISION_OVERLAP.days)
+    )
+
+
+async def async_update_options(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Apply changed options, the revision overlap doesn't need a reload."""
+    coordinator, _ = hass.data[DOMAIN][entry.entry_id]
+    platforms = [p for p in PLATFORMS if entry.options.get(p, True)]
+    if platforms != coordinator.platforms:
+        await async_reload_entry(hass, entry)
+        return
+
+    coordinator.revision_overlap = _get_revision_overlap(entry)
+    _LOGGER.debug(f"revision overlap set to {coordinator.revision_overlap}")
+
+
 async def async_reload_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
-    await async_unload_entry(hass, entry)
-    await async_setup_entry(hass, entry)
+    # Through config entries, so async_on_unload callbacks (scheduler, listeners)
+    # run and the old coordinator is gone before the new one is set up
+    await hass.config_entries.async_reload(entry.entry_id)
 
 
 def _calculate_datacoordinator_update_interval() -> timedelta:
@@ -124,8 +213,6 @@ def _calculate_datacoordinator_update_interval() -> timedelta:
 
 
 async def async_migrate_entry(hass: HomeAssistant, entry: ConfigEntry):
-    api = SynergyAPI(entry)
-
     update_integration(hass, entry, SynergyDeviceInfo(entry.data[CONF_PREMISE_ID]))
     return True
 
@@ -139,11 +226,102 @@ def SynergyDeviceInfo(premise_id):
     )
 
 
-def SynergyAPI(entry: ConfigEntry):
+def SynergyIntervalDeviceInfo(premise_id, device_id):
+    return DeviceInfo(
+        identifiers={
+            ("interval_device_id", f"{premise_id}-{device_id}"),
+        },
+        name=f"{premise_id} {device_id}",
+        via_device=("premise_id", premise_id),
+    )
+
+
+def SynergyAPI(entry: ConfigEntry, transport=None, session=None):
     return SynergyDataFetcher(
         premise_id=entry.data[CONF_PREMISE_ID],
         email_address=entry.data[CONF_EMAIL],
         password=entry.data[CONF_PASSWORD],
         email_server=entry.data[CONF_HOST],
         email_port=entry.data[CONF_PORT],
+        transport=transport,
+        imap_ssl_context=client_context(),
+        session=session,
     )
+
+
+@callback
+def async_discover_premises(
+    hass: HomeAssistant, entry: ConfigEntry, api: SynergyDataFetcher
+) -> None:
+    """Start a discovery flow for every premise of the account not configured yet.
+
+    Discovered entries get the credentials of `entry`, so they share its session.
+    """
+    configured = set()
+    for other in hass.config_entries.async_entries(DOMAIN):
+        # Ignored discoveries only have an unique_id
+        configured.add(str(other.unique_id))
+        configured.add(str(other.data.get(CONF_PREMISE_ID)))
+
+    for account in api.contract_accounts:
+        premise_id = account["premise_id"]
+        if premise_id is None or str(premise_id) in configured:
+            continue
+
+        _LOGGER.debug(f"premise {premise_id} discovered in {entry.title}")
+        discovery_flow.async_create_flow(
+            hass,
+            DOMAIN,
+            context={"source": SOURCE_INTEGRATION_DISCOVERY},
+            data={
+                CONF_PREMISE_ID: premise_id,
+                CONF_EMAIL: entry.data[CONF_EMAIL],
+                CONF_PASSWORD: entry.data[CONF_PASSWORD],
+                CONF_HOST: entry.data[CONF_HOST],
+                CONF_PORT: entry.data[CONF_PORT],
+            },
+        )
+
+
+def get_cache_path(hass: HomeAssistant) -> Path:
+    return Path(hass.config.path(STORAGE_DIR, CACHE_DIRECTORY))
+
+
+def get_history_path(hass: HomeAssistant) -> Path:
+    return Path(hass.config.path(STORAGE_DIR, HISTORY_DIRECTORY))
+
+
+async def async_get_transport(hass: HomeAssistant):
+    """Return the HTTP transport shared by all config entries.
+
+    Connections are pooled and kept alive between updates of all premises. The
+    transport is closed when Home Assistant stops.
+    """
+    hass.data[DOMAIN] = hass.data.get(DOMAIN, {})
+    if DATA_TRANSPORT in hass.data[DOMAIN]:
+        return hass.data[DOMAIN][DATA_TRANSPORT]
+
+    transport = await hass.async_add_executor_job(create_transport)
+    if DATA_TRANSPORT in hass.data[DOMAIN]:
+        # Someone else won the race while we were in the executor
+        return hass.data[DOMAIN][DATA_TRANSPORT]
+
+    async def _async_close_transport(event: Event) -> None:
+        await transport.aclose()
+
+    hass.data[DOMAIN][DATA_TRANSPORT] = transport
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_CLOSE, _async_close_transport)
+
+    return transport
+
+
+async def async_get_session(hass: HomeAssistant, email_address: str) -> SynergySession:
+    """Return the selfserve session shared by all config entries of an email address."""
+    transport = await async_get_transport(hass)
+
+    sessions = hass.data[DOMAIN].setdefault(DATA_SESSIONS, {})
+    key = email_address.lower()
+    if key not in sessions:
+        sessions[key] = SynergySession(transport)
+
+    return sessions[key]
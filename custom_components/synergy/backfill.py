@@ -0,0 +1,184 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable
+from datetime import date, timedelta
+
+from .const import (
+    BACKFILL_CHUNK_LENGTH,
+    BACKFILL_CONCURRENCY,
+    BACKFILL_MAX_ATTEMPTS,
+    BACKFILL_RATE,
+    BACKFILL_RETRY_DELAY,
+)
+from .series import IntervalSeries
+
+_LOGGER = logging.getLogger(__name__)
+
+ChunkCallback = Callable[[date, date, IntervalSeries], Awaitable[None]]
+
+
+class BackfillError(Exception):
+    pass
+
+
+class TokenBucket:
+    """Allow `rate` acquisitions per second with bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self._capacity, self._tokens + (now - self._updated) * self._rate
+                )
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens = self._tokens - 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+
+class BackfillEngine:
+    """Fetch an arbitrary date range as concurrent chunks over a single session.
+
+    Chunks are requested in parallel (bounded by `concurrency` and a token bucket
+    of `rate` requests per second) and each one is retried on its own. Completed
+    chunks are handed to `on_chunk` in chronological order, so `on_chunk` can be
+    used to checkpoint progress: if chunk N fails no chunk after it is delivered.
+    """
+
+    def __init__(
+        self,
+        fetcher,
+        chunk_length: timedelta = BACKFILL_CHUNK_LENGTH,
+        concurrency: int = BACKFILL_CONCURRENCY,
+        rate: float = BACKFILL_RATE,
+        max_attempts: int = BACKFILL_MAX_ATTEMPTS,
+        on_chunk: ChunkCallback | None = None,
+    ):
+        self._fetcher = fetcher
+        self._chunk_length = chunk_length
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._bucket = TokenBucket(rate, capacity=concurrency)
+        self._max_attempts = max_attempts
+        self._on_chunk = on_chunk
+        self._session_lock = asyncio.Lock()
+
+    def chunks(self, start: date, end: date) -> list[tuple[date, date]]:
+        """Split [start, end] (both inclusive) into chunks."""
+        ret = []
+        while start <= end:
+            chunk_end = min(start + self._chunk_length - timedelta(days=1), end)
+            ret.append((start, chunk_end))
+            start = chunk_end + timedelta(days=1)
+
+        return ret
+
+    async def run(self, start: date, end: date) -> IntervalSeries:
+        chunks = self.chunks(start, end)
+        _LOGGER.debug(f"backfill {start} → {end} in {len(chunks)} chunks")
+
+        await self._ensure_session()
+
+        results: dict[int, IntervalSeries] = {}
+        next_idx = 0
+        delivered = IntervalSeries.empty()
+        deliver_lock = asyncio.Lock()
+
+        async def deliver(idx: int, series: IntervalSeries) -> None:
+            nonlocal next_idx, delivered
+
+            async with deliver_lock:
+                results[idx] = series
+                while next_idx in results:
+                    chunk_series = results.pop(next_idx)
+                    if self._on_chunk is not None:
+                        await self._on_chunk(*chunks[next_idx], chunk_series)
+
+                    delivered = delivered.merge(chunk_series)
+                    next_idx = next_idx + 1
+
+        outcomes = await asyncio.gather(
+            *[
+                self._fetch_chunk(idx, chunk_start, chunk_end, deliver)
+                for idx, (chunk_start, chunk_end) in enumerate(chunks)
+            ],
+            return_exceptions=True,
+        )
+
+        failed = [
+            chunks[idx] for idx, outcome in enumerate(outcomes) if outcome is not None
+        ]
+        if failed:
+            raise BackfillError(
+                f"{len(failed)} of {len(chunks)} chunks failed: "
+                + ", ".join(f"{s} → {e}" for s, e in failed)
+            )
+
+        return delivered
+
+    async def _fetch_chunk(
+        self,
+        idx: int,
+        start: date,
+        end: date,
+        deliver: Callable[[int, IntervalSeries], Awaitable[None]],
+    ) -> None:
+        for attempt in range(1, self._max_attempts + 1):
+            try:
+                async with self._semaphore:
+                    await self._bucket.acquire()
+                    series = await self._fetcher.fetch_series(start, end)
+
+                if series is None:
+                    raise BackfillError("no data returned")
+
+            except Exception as e:  # pylint: disable=broad-except
+                _LOGGER.debug(
+                    f"chunk {start} → {end} failed ({attempt}/{self._max_attempts}): {e}"
+                )
+                if attempt == self._max_attempts:
+                    raise
+
+                await asyncio.sleep(BACKFILL_RETRY_DELAY.total_seconds() * attempt)
+                # The fetcher forgets expired sessions, login again if needed
+                await self._ensure_session()
+
+            else:
+                _LOGGER.debug(f"chunk {start} → {end} fetched ({len(series)} intervals)")
+                await deliver(idx, series)
+                return
+
+    async def _ensure_session(self) -> None:
+        # Only one chunk logs in, the rest wait for the new session
+        async with self._session_lock:
+            if not await self._fetcher.ensure_session():
+                raise BackfillError("unable to login")
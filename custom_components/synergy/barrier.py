@@ -20,7 +20,8 @@ import enum
 import functools
 import logging
 from abc import abstractmethod
-from datetime import datetime, timedelta, timezone
+from collections.abc import Callable
+from datetime import datetime, time, timedelta, timezone
 from typing import Any
 
 from homeassistant.core import dt_util
@@ -42,6 +43,22 @@ ATTR_ALLOWED_WINDOW_HOURS = "allowed_window_hours"
 DEFAULT_MAX_RETRIES = 3
 
 
+def dump_as_json(dump: dict[str, Any]) -> dict[str, Any]:
+    """Convert the output of Barrier.dump() to JSON serializable types."""
+    ret = {}
+    for k, v in dump.items():
+        if isinstance(v, datetime):
+            v = v.isoformat()
+        elif isinstance(v, timedelta):
+            v = v.total_seconds()
+        elif isinstance(v, tuple):
+            v = list(v)
+
+        ret[k] = v
+
+    return ret
+
+
 def check_tzinfo(
     param: str | int,
     default_tzinfo: timezone = timezone.utc,
@@ -180,10 +197,13 @@ class TimeWindowBarrier(Barrier):
         allowed_window_hours: tuple[int, int],
         max_retries: int,
         max_age: timedelta,
+        on_change: Callable[[dict[str, Any]], None] | None = None,
     ):
         self._max_age = max_age
         self._allowed_window_hours = allowed_window_hours
         self._max_retries = max_retries
+        # Called with dump_as_json(self.dump()) on success and fail, to persist it
+        self._on_change = on_change
 
         zero_dt = dt_util.utc_from_timestamp(0)
 
@@ -196,6 +216,16 @@ class TimeWindowBarrier(Barrier):
     def utcnow(self) -> datetime:
         return dt_util.utcnow()
 
+    @property
+    def allowed_window_hours(self) -> tuple[int, int]:
+        return self._allowed_window_hours
+
+    @allowed_window_hours.setter
+    def allowed_window_hours(self, value: tuple[int, int]) -> None:
+        if value != self._allowed_window_hours:
+            _LOGGER.debug(f"update window changed to {value}")
+        self._allowed_window_hours = value
+
     def dump(self) -> dict[str, Any]:
         ret = {
             # Configuration
@@ -211,6 +241,47 @@ class TimeWindowBarrier(Barrier):
 
         return ret
 
+    @check_tzinfo("now", optional=True)
+    def restore(self, state: dict[str, Any] | None, now: datetime | None = None) -> None:
+        """Restore internal state from a previous dump_as_json(dump()).
+
+        Times in the future (clock changed or skewed since they were saved) are
+        clamped so they can't block updates for longer than they would have.
+        """
+        if not state:
+            return
+
+        now = now or self.utcnow()
+
+        try:
+            last_success = datetime.fromisoformat(state[ATTR_LAST_SUCCESS])
+            cooldown = datetime.fromisoformat(state[ATTR_COOLDOWN])
+            failures = int(state[ATTR_RETRY])
+            force_next = bool(state[ATTR_FORCED])
+        except (KeyError, TypeError, ValueError) as e:
+            _LOGGER.debug(f"ignoring invalid barrier state ({e})")
+            return
+
+        if last_success > now:
+            _LOGGER.debug(f"last success {last_success} is in the future, clamping")
+            last_success = now
+
+        max_cooldown = now + (self._max_age / 2)
+        if cooldown > max_cooldown:
+            _LOGGER.debug(f"cooldown {cooldown} is too far in the future, clamping")
+            cooldown = max_cooldown
+
+        self._last_success = last_success
+        self._cooldown = cooldown
+        self._failures = failures
+        self._force_next = force_next
+
+        _LOGGER.debug(f"barrier state restored: {self.dump()}")
+
+    def _changed(self) -> None:
+        if self._on_change is not None:
+            self._on_change(dump_as_json(self.dump()))
+
     @check_tzinfo("now", optional=True)
     def check(self, now: datetime | None = None) -> None:
         """
@@ -268,6 +339,41 @@ class TimeWindowBarrier(Barrier):
                 code=TimeWindowBarrierDenyError.NO_DELTA, reason=reason
             )
 
+    @check_tzinfo("now", optional=True)
+    def next_allowed(self, now: datetime | None = None) -> datetime:
+        """First time (from now on) check() will allow an update.
+
+        Follows the same rules as check(): forced, cooldown, retrying, update
+        window and min age since the last success.
+        """
+        now = now or self.utcnow()
+
+        if self._force_next:
+            return now
+
+        candidate = max(now, self._cooldown)
+        if self._failures > 0 and self._failures < self._max_retries:
+            return candidate
+
+        min_age = timedelta(
+            hours=self._allowed_window_hours[1] - self._allowed_window_hours[0]
+        )
+        candidate = max(candidate, self._last_success + min_age + timedelta(seconds=1))
+
+        local = dt_util.as_local(candidate)
+        if self._allowed_window_hours[0] <= local.hour <= self._allowed_window_hours[1]:
+            return candidate
+
+        # Next window opening, today or tomorrow
+        day = local.date()
+        if local.hour > self._allowed_window_hours[1]:
+            day = day + timedelta(days=1)
+
+        window_start = datetime.combine(
+            day, time(hour=self._allowed_window_hours[0]), tzinfo=local.tzinfo
+        )
+        return dt_util.as_utc(window_start)
+
     def force_next(self) -> None:
         self._force_next = True
 
@@ -280,6 +386,7 @@ class TimeWindowBarrier(Barrier):
         self._last_success = now
 
         _LOGGER.debug("success registered")
+        self._changed()
 
     @check_tzinfo("now", optional=True)
     def fail(self, now: datetime | None = None) -> None:
@@ -297,6 +404,8 @@ class TimeWindowBarrier(Barrier):
                 f"max failures reached, setup cooldown barrier until {cooldown_until}"
             )
 
+        self._changed()
+
 
 class TimeWindowBarrierDenyError(enum.Enum):
     UPDATE_WINDOW_CLOSED = enum.auto()
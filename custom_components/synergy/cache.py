@@ -0,0 +1,303 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import asyncio
+import gzip
+import json
+import logging
+import os
+from collections.abc import Callable
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+
+from homeassistant.core import HomeAssistant
+
+from .series import INTERVAL_LENGTH, IntervalSeries
+from .SynergyDataFetcher import SYNERGY_TIMEZONE
+
+_LOGGER = logging.getLogger(__name__)
+
+INTERVALS_PER_DAY = 24 * 3600 // INTERVAL_LENGTH
+
+
+def _day_start(day: date) -> int:
+    return int(datetime.combine(day, time.min, tzinfo=SYNERGY_TIMEZONE).timestamp())
+
+
+class DayCache:
+    """Compressed, append-only cache of decoded interval data, one file per day.
+
+    Only complete days are stored and a stored day is never rewritten. All methods
+    do blocking IO, run them in an executor.
+    """
+
+    def __init__(self, path: Path | str):
+        self._path = Path(path)
+
+    def _day_path(self, day: date) -> Path:
+        return self._path / f"{day.isoformat()}.json.gz"
+
+    def load(self, day: date) -> IntervalSeries | None:
+        try:
+            with gzip.open(self._day_path(day), "rt", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError) as e:
+            _LOGGER.warning(f"{self._day_path(day)}: ignoring broken cache file ({e})")
+            return None
+
+        return IntervalSeries.from_values(data["start"], data["columns"])
+
+    def load_range(self, start: date, end: date) -> tuple[IntervalSeries, date | None]:
+        """Load cached days from start on.
+
+        Returns the series for the longest run of cached days starting at `start`
+        and the first day (up to `end`) which is not cached, or None if all of them
+        are.
+        """
+        series = IntervalSeries.empty()
+        day = start
+        while day <= end:
+            day_series = self.load(day)
+            if day_series is None:
+                return series, day
+
+            series = series.merge(day_series)
+            day = day + timedelta(days=1)
+
+        return series, None
+
+    def store(self, series: IntervalSeries, final_before: int) -> int:
+        """Store the complete days of `series` ending before `final_before`.
+
+        A day is complete if all of its intervals have a valid total. Returns the
+        number of new days stored.
+        """
+        if not series:
+            return 0
+
+        stored = 0
+        day = datetime.fromtimestamp(series.start, SYNERGY_TIMEZONE).date()
+        while True:
+            day_start = _day_start(day)
+            day_end = day_start + INTERVALS_PER_DAY * INTERVAL_LENGTH
+            if day_end > min(series.end, final_before):
+                break
+
+            day_series = series.slice(day_start, day_end)
+            if (
+                day_series.start == day_start
+                and len(day_series) == INTERVALS_PER_DAY
+                and all(day_series.mask("total_kwh"))
+                and not self._day_path(day).exists()
+            ):
+                self._write(day, day_series)
+                stored = stored + 1
+
+            day = day + timedelta(days=1)
+
+        return stored
+
+    def _write(self, day: date, series: IntervalSeries) -> None:
+        self._path.mkdir(parents=True, exist_ok=True)
+
+        data = {
+            "start": series.start,
+            "columns": {
+                name: [
+                    value if valid else None
+                    for value, valid in zip(series.column(name), series.mask(name))
+                ]
+                for name in series.columns
+            },
+        }
+
+        # Write and rename so readers never see a partial file
+        path = self._day_path(day)
+        tmp_path = path.with_suffix(".tmp")
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as fh:
+            json.dump(data, fh, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+
+class CachedSeriesFetcher:
+    """SynergyDataFetcher wrapper that serves finalized days from a DayCache.
+
+    Exposes the ensure_session()/fetch_series() interface used by BackfillEngine.
+    Only days which are missing from the cache (or still provisional) are
+    requested to the API and the login is delayed until it is really needed.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        fetcher,
+        cache_path: Path,
+        final_before: Callable[[], int | None],
+        login_semaphore: asyncio.Semaphore | None = None,
+        fetch_semaphore: asyncio.Semaphore | None = None,
+    ):
+        self._hass = hass
+        self._fetcher = fetcher
+        self._cache_path = cache_path
+        self._final_before = final_before
+        # Shared with other premises to cap concurrent logins and data requests
+        self._login_semaphore = login_semaphore or asyncio.Semaphore(1)
+        self._fetch_semaphore = fetch_semaphore or asyncio.Semaphore(1)
+
+    @property
+    def cache(self) -> DayCache | None:
+        return self._get_cache()
+
+    def _get_cache(self, device_id: str | None = None) -> DayCache | None:
+        # Cache is partitioned by device, unknown until account metadata is loaded
+        device_id = device_id or self._fetcher.device_id
+        if device_id is None:
+            return None
+
+        return DayCache(self._cache_path / str(self._fetcher.premise_id) / str(device_id))
+
+    async def ensure_session(self) -> bool:
+        # Login is done by fetch_series() if the network is needed at all
+        return True
+
+    async def fetch_series(
+        self, start_date: date, end_date: date, device_id: str | None = None
+    ) -> IntervalSeries | None:
+        """Intervals of an interval device, the first one by default."""
+        cached, fetch_start = await self._load_cached(start_date, end_date, device_id)
+        if fetch_start is None:
+            return cached
+
+        return await self._fetch_uncached(cached, fetch_start, end_date, device_id)
+
+    async def fetch_all_series(
+        self, start_date: date, end_date: date
+    ) -> dict[str, IntervalSeries] | None:
+        """fetch_series() for every interval device of the premise, by device id.
+
+        The first device is fetched before the others since it loads the account
+        metadata (and the device list). The rest are requested in parallel, a
+        failed one (returning None or raising) is left out. None if the first one
+        fails.
+        """
+        series = await self.fetch_series(start_date, end_date)
+        if series is None:
+            return None
+
+        ret = {self._fetcher.device_id: series}
+
+        pending = []
+        for device_id in self._fetcher.device_ids[1:]:
+            cached, fetch_start = await self._load_cached(start_date, end_date, device_id)
+            if fetch_start is None:
+                ret[device_id] = cached
+            else:
+                pending.append((device_id, cached, fetch_start))
+
+        if pending:
+            results = await asyncio.gather(
+                *(
+                    self._fetch_uncached(cached, fetch_start, end_date, device_id)
+                    for device_id, cached, fetch_start in pending
+                ),
+                return_exceptions=True,
+            )
+
+            for (device_id, _, _), device_series in zip(pending, results):
+                if isinstance(device_series, BaseException):
+                    _LOGGER.warning(f"device {device_id}: fetch failed ({device_series!r})")
+                    continue
+
+                if device_series is None:
+                    _LOGGER.debug(f"device {device_id}: fetch failed")
+                    continue
+
+                ret[device_id] = device_series
+
+        return ret
+
+    async def _load_cached(
+        self, start_date: date, end_date: date, device_id: str | None
+    ) -> tuple[IntervalSeries, date | None]:
+        cache = self._get_cache(device_id)
+        if cache is None:
+            return IntervalSeries.empty(), start_date
+
+        cached, fetch_start = await self._hass.async_add_executor_job(
+            cache.load_range, start_date, end_date
+        )
+        if fetch_start is None:
+            _LOGGER.debug(f"{start_date} → {end_date} served from cache")
+
+        return cached, fetch_start
+
+    async def _fetch_uncached(
+        self,
+        cached: IntervalSeries,
+        fetch_start: date,
+        end_date: date,
+        device_id: str | None,
+    ) -> IntervalSeries | None:
+        """Fetch from fetch_start and add the cached days."""
+        # Shared by all premises logged in with the same session
+        async with self._fetcher.session_lock:
+            if not self._fetcher.has_session:
+                async with self._login_semaphore:
+                    if not await self._fetcher.ensure_session():
+                        return None
+
+        async with self._fetch_semaphore:
+            series = await self._fetcher.fetch_series(
+                fetch_start, end_date, device_id=device_id
+            )
+        if series is None:
+            return None
+
+        final_before = self._final_before()
+        cache = self._get_cache(device_id)
+        if cache is not None and final_before is not None:
+            stored = await self._hass.async_add_executor_job(cache.store, series, final_before)
+            _LOGGER.debug(f"{stored} new days stored in cache")
+
+        return cached.merge(series)
+
+    async def async_load_recent(
+        self, length: timedelta, device_id: str | None = None
+    ) -> IntervalSeries:
+        """Load the cached days within the last `length`, used on startup."""
+        cache = self._get_cache(device_id)
+        if cache is None:
+            return IntervalSeries.empty()
+
+        end = datetime.now(SYNERGY_TIMEZONE).date()
+        start = end - length
+
+        def fn():
+            series = IntervalSeries.empty()
+            day = start
+            while day <= end:
+                day_series = cache.load(day)
+                if day_series is not None:
+                    series = series.merge(day_series)
+                day = day + timedelta(days=1)
+
+            return series
+
+        return await self._hass.async_add_executor_job(fn)
@@ -20,16 +20,23 @@
 import os
 from typing import Any
 
-from .SynergyDataFetcher import SynergyDataFetcher, get_premise_id, AddressError
+from .SynergyDataFetcher import SynergyDataFetcher, get_premise_id, AddressError, create_client
 import voluptuous as vol
 from homeassistant import config_entries
 from homeassistant.const import CONF_ADDRESS, CONF_EMAIL, CONF_PASSWORD, CONF_HOST, CONF_PORT
-from homeassistant.core import callback  # noqa: F401
+from homeassistant.core import callback
 from homeassistant.data_entry_flow import FlowResult
 from homeassistant.helpers.aiohttp_client import async_create_clientsession
 
-from . import _LOGGER
-from .const import CONF_PREMISE_ID, CONFIG_ENTRY_VERSION, DOMAIN
+from . import _LOGGER, async_get_transport
+from .const import (
+    CONF_PREMISE_ID,
+    CONF_REVISION_OVERLAP,
+    CONFIG_ENTRY_VERSION,
+    DEFAULT_REVISION_OVERLAP,
+    DOMAIN,
+    HISTORICAL_PERIOD_LENGHT,
+)
 
 AUTH_SCHEMA = vol.Schema(
     {
@@ -49,10 +56,10 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):  # type: ignore[call
         self.info = {}
         self.api = None
 
-    # @staticmethod
-    # @callback
-    # def async_get_options_flow(config_entry):
-    #     return OptionsFlowHandler(config_entry)
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry):
+        return OptionsFlowHandler(config_entry)
 
     async def async_step_user(
         self, user_input: dict[str, Any] | None = None
@@ -73,9 +80,11 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):  # type: ignore[call
             email_server = user_input[CONF_HOST]
             email_port = user_input[CONF_PORT]
 
+            transport = await async_get_transport(self.hass)
+
             premise_id = None
             try:
-                premise_id = get_premise_id(physical_address)
+                premise_id = await get_premise_id(physical_address, client=create_client(transport))
 
             except AddressError:
                 errors["base"] = "invalid_address"
@@ -86,7 +95,8 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):  # type: ignore[call
 
             if  premise_id is not None:
                 try:
-                    self.api = await create_api(premise_id, email_address, email_password, email_server, email_port)
+                    self.api = await create_api(premise_id, email_address, email_password, email_server, email_port,
+                                                transport)
 
                 except Exception:  # pylint: disable=broad-except
                     _LOGGER.exception("Unexpected exception")
@@ -111,26 +121,69 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):  # type: ignore[call
             errors=errors,
         )
 
+    async def async_step_integration_discovery(
+        self, discovery_info: dict[str, Any]
+    ) -> FlowResult:
+        """Handle a premise found in the contract accounts of a configured one."""
+        premise_id = discovery_info[CONF_PREMISE_ID]
 
-# class OptionsFlowHandler(config_entries.OptionsFlow):
-#     def __init__(self, config_entry):
-#         """Initialize options flow."""
-#         self.config_entry = config_entry
-#
-#     async def async_step_init(self, user_input=None):
-#         if user_input is not None:
-#             return self.async_create_entry(title="", data=user_input)
-#
-#         OPTIONS_SCHEMA = vol.Schema({})
-#
-#         return self.async_show_form(step_id="init", data_schema=OPTIONS_SCHEMA)
+        await self.async_set_unique_id(str(premise_id))
+        self._abort_if_unique_id_configured()
+
+        self.info.update(discovery_info)
+        self.context["title_placeholders"] = {"premise_id": str(premise_id)}
+
+        return await self.async_step_discovery_confirm()
+
+    async def async_step_discovery_confirm(
+        self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        premise_id = self.info[CONF_PREMISE_ID]
+
+        if user_input is not None:
+            return self.async_create_entry(title=f"Premise {premise_id}", data=self.info)
+
+        return self.async_show_form(
+            step_id="discovery_confirm",
+            description_placeholders={"premise_id": str(premise_id)},
+        )
+
+
+class OptionsFlowHandler(config_entries.OptionsFlow):
+    def __init__(self, config_entry):
+        """Initialize options flow."""
+        self.config_entry = config_entry
+
+    async def async_step_init(self, user_input=None):
+        if user_input is not None:
+            # Keep options not shown in the form
+            return self.async_create_entry(
+                title="", data={**self.config_entry.options, **user_input}
+            )
+
+        OPTIONS_SCHEMA = vol.Schema(
+            {
+                vol.Required(
+                    CONF_REVISION_OVERLAP,
+                    default=self.config_entry.options.get(
+                        CONF_REVISION_OVERLAP, DEFAULT_REVISION_OVERLAP.days
+                    ),
+                ): vol.All(
+                    vol.Coerce(int),
+                    vol.Range(min=0, max=HISTORICAL_PERIOD_LENGHT.days),
+                ),
+            }
+        )
+
+        return self.async_show_form(step_id="init", data_schema=OPTIONS_SCHEMA)
 
 
-async def create_api(premise_id, email_address, email_password, email_server, email_port):
+async def create_api(premise_id, email_address, email_password, email_server, email_port, transport=None):
     return SynergyDataFetcher(
         premise_id=premise_id,
         email_address=email_address,
         password=email_password,
         email_server=email_server,
         email_port=email_port,
+        transport=transport,
     )
@@ -21,15 +21,75 @@ from datetime import timedelta
 DOMAIN = "synergy"
 
 CONF_PREMISE_ID = "premise_id"
+CONF_REVISION_OVERLAP = "revision_overlap"
 
 MAX_RETRIES = 3
 MIN_SCAN_INTERVAL = 60
+MIN_FETCH_INTERVAL = timedelta(minutes=10)
+# Logins of all premises may share the same mailbox for OTP emails
+FLEET_MAX_CONCURRENT_LOGINS = 1
+# Data requests over an existing session, room for a backfill and regular updates
+FLEET_MAX_CONCURRENT_FETCHES = 4
 UPDATE_WINDOW_START_MINUTE = 50
 UPDATE_WINDOW_END_MINUTE = 59
 API_USER_SESSION_TIMEOUT = 60
+API_CONNECT_TIMEOUT = 10
+API_READ_TIMEOUT = 30
+API_USAGE_DATA_READ_TIMEOUT = 120
+API_MAX_CONNECTIONS = 10
+API_MAX_KEEPALIVE_CONNECTIONS = 5
+API_KEEPALIVE_EXPIRY = 60
+API_SESSION_MAX_AGE = timedelta(hours=12)
+ACCOUNT_METADATA_MAX_AGE = timedelta(days=7)
+IMAP_TIMEOUT = 10
+IMAP_IDLE_TIMEOUT = 60
+IMAP_POLL_INTERVAL = 10
+
+DATA_TRANSPORT = "transport"
+DATA_LAST_STATISTICS = "last_statistics"
+DATA_FLEET = "fleet"
+DATA_SESSIONS = "sessions"
+
+STORAGE_VERSION = 1
+STORAGE_SAVE_DELAY = 10
+STORAGE_KEY_SESSION = "session"
+STORAGE_KEY_ACCOUNT_METADATA = "account_metadata"
+STORAGE_KEY_WATERMARK = "watermark"
+STORAGE_KEY_BACKFILL = "backfill"
+STORAGE_KEY_WRITTEN = "written"
+STORAGE_KEY_VERIFIED = "verified"
+STORAGE_KEY_CLEANED = "cleaned"
+STORAGE_KEY_BARRIER = "barrier"
+STORAGE_KEY_PUBLICATION = "publication"
+
+CACHE_DIRECTORY = f"{DOMAIN}_cache"
+HISTORY_DIRECTORY = f"{DOMAIN}_history"
+
+SERVICE_BACKFILL = "backfill"
+SERVICE_VERIFY_STATISTICS = "verify_statistics"
+ATTR_CONFIG_ENTRY_ID = "config_entry_id"
+ATTR_START_DATE = "start_date"
+ATTR_END_DATE = "end_date"
 
 DATA_ATTR_HISTORICAL_CONSUMPTION = "historical_consumption"
 DATA_ATTR_HISTORICAL_GENERATION = "historical_generation"
 
 HISTORICAL_PERIOD_LENGHT = timedelta(days=5)
+
+BACKFILL_CHUNK_LENGTH = timedelta(days=30)
+BACKFILL_CONCURRENCY = 3
+BACKFILL_RATE = 1.0
+BACKFILL_MAX_ATTEMPTS = 3
+BACKFILL_RETRY_DELAY = timedelta(seconds=10)
+DEFAULT_REVISION_OVERLAP = timedelta(days=1)
+
+PUBLICATION_MAX_OBSERVATIONS = 30
+PUBLICATION_MIN_OBSERVATIONS = 7
+PUBLICATION_QUANTILE = 0.8
+# While the previous day is missing it's looked for with the live session (no
+# login) every PUBLICATION_PROBE_INTERVAL, the first probe seeing it is recorded
+PUBLICATION_PROBE_LAG = timedelta(days=1)
+PUBLICATION_PROBE_INTERVAL = timedelta(minutes=20)
+# Fetches are spread over this time after the learned publication time
+PUBLICATION_FETCH_SPREAD = timedelta(minutes=30)
 CONFIG_ENTRY_VERSION = 1
@@ -16,22 +16,45 @@
 # USA.
 
 
+import asyncio
 import enum
+import hashlib
 import logging
-from datetime import datetime, timedelta, timezone
-from typing import Any, TypedDict
+from array import array
+from datetime import date, datetime, time, timedelta, timezone
+from pathlib import Path
+from collections.abc import Callable
+from typing import Any, TypedDict, TypeVar
 
-from .SynergyDataFetcher import SynergyDataFetcher
+from .SynergyDataFetcher import SYNERGY_TIMEZONE, SessionExpiredError, SynergyDataFetcher
 from homeassistant.core import dt_util
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator
 
-from .barrier import Barrier, BarrierDeniedError
+from .backfill import BackfillEngine
+from .barrier import Barrier, BarrierDeniedError, TimeWindowBarrier
+from .cache import CachedSeriesFetcher
 from .const import (
     DATA_ATTR_HISTORICAL_CONSUMPTION,
     DATA_ATTR_HISTORICAL_GENERATION,
+    DEFAULT_REVISION_OVERLAP,
     HISTORICAL_PERIOD_LENGHT,
+    PUBLICATION_PROBE_INTERVAL,
+    PUBLICATION_PROBE_LAG,
+    STORAGE_KEY_ACCOUNT_METADATA,
+    STORAGE_KEY_BACKFILL,
+    STORAGE_KEY_PUBLICATION,
+    STORAGE_KEY_SESSION,
+    STORAGE_KEY_WATERMARK,
 )
 from .entity import SynergyEntity
+from .fleet import async_get_fleet
+from .intervalstore import IntervalStore, IntervalStoreError
+from .publication import PublicationModel, last_complete_day
+from .series import IntervalSeries
+from .storage import SynergyStorage
+
+
+_T = TypeVar("_T")
 
 
 class DataSetType(int):
@@ -65,7 +88,11 @@ class SynergyCoordinator(DataUpdateCoordinator):
         api,
         # barriers: dict[DataSetType, Barrier],
         barrier: Barrier,
+        storage: SynergyStorage,
+        cache_path: Path,
+        history_path: Path,
         update_interval: timedelta = timedelta(seconds=30),
+        revision_overlap: timedelta = DEFAULT_REVISION_OVERLAP,
     ):
         name = (
             f"synergy coordinator"
@@ -81,13 +108,128 @@ class SynergyCoordinator(DataUpdateCoordinator):
 
         self.api = api
         self.barrier = barrier
+        self.storage = storage
+        self.revision_overlap = revision_overlap
+        # Finalized days are served from disk, only the rest reach the API
+        self.fetcher = CachedSeriesFetcher(
+            hass,
+            api,
+            cache_path,
+            self._final_before,
+            login_semaphore=async_get_fleet(hass).login_semaphore,
+            fetch_semaphore=async_get_fleet(hass).fetch_semaphore,
+        )
+        # Full interval history, partitioned by device once it is known
+        self.history_path = history_path
+        self.history: IntervalStore | None = None
+        self._backfill_lock = asyncio.Lock()
+
+        # Learn when Synergy publishes new days and fetch then, the barrier's
+        # window is used until there are enough observations
+        self.publication = PublicationModel(storage.get(STORAGE_KEY_PUBLICATION))
+        self._static_window_hours = (
+            barrier.allowed_window_hours if isinstance(barrier, TimeWindowBarrier) else None
+        )
+        # Previous day if it was missing at the last fetch or probe, and when
+        self._publication_missing: tuple[date, datetime] | None = None
+        # Learned publication time (HA local time), fetches are anchored on it
+        self.publication_time: time | None = None
+        self._apply_publication_window()
 
         # FIXME: platforms from HomeAssistant should have types
         self.platforms: list[str] = []
 
         self.sensors: list[SynergyEntity] = []
 
-        self.data: list[dict[str, Any]]
+        self.data: IntervalSeries | None
+        # Data of the other interval devices (ex. solar or controlled load meters),
+        # `data` is the first device. Only kept in the day cache
+        self.device_data: dict[str, IntervalSeries] = {}
+
+    @property
+    def data(self) -> IntervalSeries | None:
+        return self._data
+
+    @data.setter
+    def data(self, value: IntervalSeries | None) -> None:
+        # DataUpdateCoordinator sets data on every refresh, even if unchanged
+        if value is getattr(self, "_data", None) and hasattr(self, "_memo"):
+            return
+
+        self._data = value
+        self._data_changed()
+
+    def _data_changed(self) -> None:
+        self._data_version = getattr(self, "_data_version", 0) + 1
+        self._memo: dict[Any, Any] = {}
+
+    @property
+    def data_version(self) -> int:
+        """Counter increased every time data changes."""
+        return self._data_version
+
+    def memoize(self, key: Any, fn: Callable[[], _T]) -> _T:
+        """Return fn() computed once per data version, shared by all sensors."""
+        if key not in self._memo:
+            self._memo[key] = fn()
+
+        return self._memo[key]
+
+    def series(self, device_id: str | None = None) -> IntervalSeries | None:
+        """Data of an interval device, `data` (the first device) by default."""
+        if device_id is None:
+            return self.data
+
+        return self.device_data.get(device_id)
+
+    def local_datetimes(self, device_id: str | None = None) -> list[datetime]:
+        """Local datetime of each interval of data."""
+
+        def fn():
+            series = self.series(device_id)
+            if not series:
+                return []
+
+            return series.datetimes(dt_util.DEFAULT_TIME_ZONE)
+
+        return self.memoize(("local_datetimes", device_id), fn)
+
+    def day_digests(
+        self, column: str, device_id: str | None = None
+    ) -> list[tuple[int, int, str]]:
+        """(start, end, digest) for each (Synergy) day of data.
+
+        Digests only depend on valid values of `column`, they change when an
+        interval is published or revised.
+        """
+
+        def fn():
+            series = self.series(device_id)
+            if not series:
+                return []
+
+            ret = []
+            day_start = int(
+                datetime.fromtimestamp(series.start, SYNERGY_TIMEZONE)
+                .replace(hour=0, minute=0, second=0)
+                .timestamp()
+            )
+            # Australia/Perth has no DST, all days have the same length
+            while day_start < series.end:
+                day_end = day_start + 24 * 3600
+                day = series.slice(day_start, day_end)
+                values = array(
+                    "d",
+                    (x if valid else 0 for x, valid in zip(day.column(column), day.mask(column))),
+                )
+                digest = hashlib.blake2b(values.tobytes(), digest_size=8)
+                digest.update(day.mask(column))
+                ret.append((day_start, day_end, digest.hexdigest()))
+                day_start = day_end
+
+            return ret
+
+        return self.memoize(("day_digests", column, device_id), fn)
 
     async def _async_update_data(self):
         """Fetch data from API endpoint.
@@ -106,31 +248,315 @@ class SynergyCoordinator(DataUpdateCoordinator):
 
         # Raise UpdateFailed is something were wrong
 
+        if self.backfill_in_progress:
+            # Backfilled states must reach the recorder before newer ones
+            _LOGGER.debug("update denied: backfill in progress")
+            return self.data
+
         try:
             self.barrier.check()
 
         except BarrierDeniedError as deny:
             _LOGGER.debug(f"update denied: {deny.reason}")
-            return
+            return self.data
 
-        end = datetime.today()
+        end = datetime.now(SYNERGY_TIMEZONE).date()
         start = end - HISTORICAL_PERIOD_LENGHT
 
-        _LOGGER.debug(f"update started")
+        # Only ask for what is newer than the last finalized interval (and a few
+        # already known intervals in case Synergy revised them)
+        watermark = self.watermark
+        if watermark is not None:
+            start = (watermark - self.revision_overlap).astimezone(SYNERGY_TIMEZONE).date()
 
-        await self.api.fetch(start_date=start, end_date=end)
-        data = self.api.parse()
+        _LOGGER.debug(f"update started ({start} → {end}, watermark: {watermark})")
+
+        try:
+            all_series = await self._async_fetch_series(start, end)
+        finally:
+            # Keep the session (or forget it if it expired) for the next update
+            self.store_api_state()
+
+        series = None
+        if all_series is not None:
+            series = all_series.pop(self.api.device_id, None)
+            self._merge_device_data(all_series)
+
+        data = None
+        if series is not None:
+            await self._async_write_history(series)
+            data = self._merge_data(series)
+            self._update_watermark(series.last_valid_timestamp("total_kwh"))
 
         if data is None:
             self.barrier.fail()
             _LOGGER.debug(f"update failed")
-            return []
+            return self.data
 
         self.barrier.success()
         _LOGGER.debug(f"update successful")
 
+        self._observe_publication(last_complete_day(self.storage.get(STORAGE_KEY_WATERMARK)))
+
         return data
 
+    @property
+    def publication_probe_needed(self) -> bool:
+        """The previous day is missing and can be looked for without a login."""
+        return (
+            self._publication_missing is not None
+            and self.api.has_session
+            and not self.backfill_in_progress
+        )
+
+    async def async_probe_publication(self) -> bool:
+        """Look for the missing previous day with the live session.
+
+        Probes never login, so they can run outside the update window and catch
+        the time data is published. Returns True if the day showed up, the barrier
+        then lets the next update through to fetch it.
+        """
+        if not self.publication_probe_needed:
+            return False
+
+        day = self._publication_missing[0]
+        try:
+            async with async_get_fleet(self.hass).fetch_semaphore:
+                series = await self.api.fetch_series(day, day + timedelta(days=1))
+        except SessionExpiredError:
+            _LOGGER.debug("session expired, stop probing")
+            self.store_api_state()
+            return False
+        except Exception as e:  # pylint: disable=broad-except
+            _LOGGER.debug(f"probe failed ({e!r})")
+            return False
+
+        if series is None:
+            return False
+
+        published = last_complete_day(series.last_valid_timestamp("total_kwh"))
+        self._observe_publication(published)
+        if published is None or published < day:
+            return False
+
+        self.barrier.force_next()
+        return True
+
+    def _observe_publication(self, day: date | None) -> None:
+        """Track the previous day, record the time it shows up after being seen
+        missing. `day` is the last complete day seen."""
+        now = dt_util.utcnow()
+
+        # Only if it was missing recently, or the observation is a poor upper bound
+        missing = self._publication_missing
+        if (
+            missing is not None
+            and day is not None
+            and day >= missing[0]
+            and now - missing[1] <= 2 * PUBLICATION_PROBE_INTERVAL
+        ):
+            _LOGGER.debug(f"new day published ({missing[0]})")
+            self.publication.record(now)
+            self.storage.set(STORAGE_KEY_PUBLICATION, self.publication.dump())
+            self._apply_publication_window()
+
+        expected = datetime.now(SYNERGY_TIMEZONE).date() - PUBLICATION_PROBE_LAG
+        if day is None or day < expected:
+            _LOGGER.debug(f"{expected} not published yet")
+            self._publication_missing = (expected, now)
+        else:
+            self._publication_missing = None
+
+    def _apply_publication_window(self) -> None:
+        if self._static_window_hours is None:
+            return
+
+        learned = self.publication.learned_time()
+        if learned is None:
+            self.publication_time = None
+            self.barrier.allowed_window_hours = self._static_window_hours
+            return
+
+        today = datetime.now(SYNERGY_TIMEZONE).date()
+        self.publication_time = dt_util.as_local(datetime.combine(today, learned)).time()
+
+        # The window doesn't wrap around midnight but must be at least one hour
+        # wide, or the barrier's min age since the last success would be zero
+        hour = self.publication_time.hour
+        self.barrier.allowed_window_hours = (hour, hour + 1) if hour < 23 else (22, 23)
+
+    async def _async_fetch_series(
+        self, start: date, end: date
+    ) -> dict[str, IntervalSeries] | None:
+        try:
+            return await self.fetcher.fetch_all_series(start, end)
+        except SessionExpiredError:
+            # The expired session is already forgotten, next try logs in again
+            _LOGGER.debug("session expired, login again")
+            return await self.fetcher.fetch_all_series(start, end)
+
+    async def async_restore_data(self) -> None:
+        """Load the retention period from the history (or the cached days), so
+        sensors don't have to wait for the first update."""
+        series = IntervalSeries.empty()
+
+        history = await self._async_get_history()
+        if history is not None:
+            end = int(datetime.now(SYNERGY_TIMEZONE).timestamp())
+            series = await self.async_read_history(
+                end - int(HISTORICAL_PERIOD_LENGHT.total_seconds()), end
+            )
+
+        if not series:
+            series = await self.fetcher.async_load_recent(HISTORICAL_PERIOD_LENGHT)
+
+        if series:
+            self.data = self._merge_data(series)
+            _LOGGER.debug(f"restored {len(series)} intervals from cache")
+
+        self._merge_device_data(
+            {
+                device_id: await self.fetcher.async_load_recent(
+                    HISTORICAL_PERIOD_LENGHT, device_id
+                )
+                for device_id in self.api.device_ids[1:]
+            }
+        )
+
+    async def _async_get_history(self) -> IntervalStore | None:
+        if self.history is None and self.api.device_id is not None:
+            path = self.history_path / str(self.api.premise_id) / str(self.api.device_id)
+            try:
+                self.history = await self.hass.async_add_executor_job(IntervalStore, path)
+            except (IntervalStoreError, OSError) as e:
+                # History is only a cache, the day cache and the API still work
+                _LOGGER.warning(f"history unavailable: {e}")
+
+        return self.history
+
+    async def _async_write_history(self, series: IntervalSeries) -> None:
+        history = await self._async_get_history()
+        if history is None:
+            return
+
+        try:
+            await self.hass.async_add_executor_job(history.write, series)
+        except (IntervalStoreError, OSError) as e:
+            _LOGGER.warning(f"unable to write history: {e}")
+
+    async def async_read_history(self, start: int, end: int) -> IntervalSeries:
+        """Intervals between timestamps [start, end) from the history files."""
+        history = await self._async_get_history()
+        if history is None:
+            return IntervalSeries.empty()
+
+        try:
+            return await self.hass.async_add_executor_job(history.read_series, start, end)
+        except (IntervalStoreError, OSError) as e:
+            _LOGGER.warning(f"unable to read history: {e}")
+            return IntervalSeries.empty()
+
+    async def async_close(self) -> None:
+        if self.history is not None:
+            await self.hass.async_add_executor_job(self.history.close)
+            self.history = None
+
+    def _final_before(self) -> int | None:
+        # Intervals older than the revision overlap won't be requested again
+        watermark = self.watermark
+        if watermark is None:
+            return None
+
+        return int((watermark - self.revision_overlap).timestamp())
+
+    @property
+    def watermark(self) -> datetime | None:
+        watermark = self.storage.get(STORAGE_KEY_WATERMARK)
+        return dt_util.utc_from_timestamp(watermark) if watermark else None
+
+    def _update_watermark(self, last_finalized: int | None) -> None:
+        watermark = self.storage.get(STORAGE_KEY_WATERMARK)
+        if last_finalized is None or (watermark is not None and last_finalized <= watermark):
+            return
+
+        self.storage.set(STORAGE_KEY_WATERMARK, last_finalized)
+        _LOGGER.debug(f"watermark moved to {dt_util.utc_from_timestamp(last_finalized)}")
+
+    def _merge_data(self, series: IntervalSeries) -> IntervalSeries:
+        return _merge_retained(self.data, series)
+
+    def _merge_device_data(self, device_data: dict[str, IntervalSeries]) -> None:
+        changed = False
+        for device_id, series in device_data.items():
+            if not series:
+                continue
+
+            self.device_data[device_id] = _merge_retained(
+                self.device_data.get(device_id), series
+            )
+            changed = True
+
+        if changed:
+            self._data_changed()
+
+    @property
+    def backfill_in_progress(self) -> bool:
+        return self._backfill_lock.locked()
+
+    async def async_backfill(self, start: date, end: date) -> None:
+        """Fetch and write all the data between start and end (both inclusive).
+
+        Progress is checkpointed after every chunk, requesting the same range again
+        resumes it from the last written chunk.
+        """
+        async with self._backfill_lock:
+            checkpoint = self.storage.get(STORAGE_KEY_BACKFILL)
+            if (
+                checkpoint
+                and checkpoint["start"] == start.isoformat()
+                and checkpoint["end"] == end.isoformat()
+            ):
+                resume = date.fromisoformat(checkpoint["done_until"]) + timedelta(days=1)
+                _LOGGER.debug(f"resuming backfill {start} → {end} from {resume}")
+            else:
+                resume = start
+
+            if resume > end:
+                _LOGGER.debug(f"backfill {start} → {end} already completed")
+                return
+
+            async def on_chunk(chunk_start: date, chunk_end: date, series: IntervalSeries):
+                # Only the first interval device is backfilled
+                for sensor in self.sensors:
+                    if sensor.interval_device_id is None:
+                        await sensor.async_write_historical_series(series)
+
+                await self._async_write_history(series)
+                self.data = self._merge_data(series)
+                self._update_watermark(series.last_valid_timestamp("total_kwh"))
+                self.storage.set(
+                    STORAGE_KEY_BACKFILL,
+                    {
+                        "start": start.isoformat(),
+                        "end": end.isoformat(),
+                        "done_until": chunk_end.isoformat(),
+                    },
+                )
+
+            try:
+                await BackfillEngine(self.fetcher, on_chunk=on_chunk).run(resume, end)
+            finally:
+                self.store_api_state()
+
+    def store_api_state(self) -> None:
+        session = self.api.export_session()
+        if session:
+            self.storage.set(STORAGE_KEY_SESSION, session)
+        else:
+            self.storage.pop(STORAGE_KEY_SESSION)
+
+        self.storage.set(STORAGE_KEY_ACCOUNT_METADATA, self.api.export_account_metadata())
+
     def register_sensor(self, sensor: SynergyEntity) -> None:
         self.sensors.append(sensor)
         _LOGGER.debug(f"Registered sensor '{sensor.__class__.__name__}'")
@@ -139,5 +565,13 @@ class SynergyCoordinator(DataUpdateCoordinator):
         self.sensors.remove(sensor)
         _LOGGER.debug(f"Unregistered sensor '{sensor.__class__.__name__}'")
 
-    def update_internal_data(self, data: dict[str, Any]):
-        self.data = self.data | data  # type: ignore[assignment]
+    def update_internal_data(self, data: IntervalSeries):
+        self.data = self.data.merge(data) if self.data else data
+
+
+def _merge_retained(current: IntervalSeries | None, series: IntervalSeries) -> IntervalSeries:
+    # New values replace the known ones for the same interval
+    merged = current.merge(series) if current else series
+
+    retention = int(HISTORICAL_PERIOD_LENGHT.total_seconds())
+    return merged.slice(merged.end - retention)
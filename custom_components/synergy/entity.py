@@ -23,8 +23,11 @@
 import logging
 
 from homeassistant.components import recorder
+from homeassistant.core import HomeAssistant
 from homeassistant.helpers.entity import DeviceInfo
+from homeassistant.helpers.start import async_at_started
 from homeassistant.helpers.update_coordinator import CoordinatorEntity
+from homeassistant.loader import async_get_integration
 from homeassistant.util import slugify
 from homeassistant_historical_sensor.recorderutil import (
     delete_entity_invalid_states,
@@ -33,6 +36,8 @@ from homeassistant_historical_sensor.recorderutil import (
 
 from custom_components.synergy import CONF_PREMISE_ID
 
+from .const import DOMAIN, STORAGE_KEY_CLEANED
+
 SensorType = type["SynergyEntity"]
 
 
@@ -52,10 +57,14 @@ class SynergyEntity(CoordinatorEntity):
     SYNERGY_ENTITY_NAME = ""
     # SYNERGY_DATA_SETS = []  # type: ignore[var-annotated]
 
-    def __init__(self, *args, config_entry, device_info, **kwargs):
+    def __init__(
+        self, *args, config_entry, device_info, interval_device_id=None, **kwargs
+    ):
         super().__init__(*args, **kwargs)
 
         self.config_entry = config_entry
+        # None for the first interval device of the premise
+        self.interval_device_id = interval_device_id
 
         self._attr_has_entity_name = True
         self._attr_name = self.SYNERGY_ENTITY_NAME
@@ -77,8 +86,23 @@ class SynergyEntity(CoordinatorEntity):
         return f"<{clsname} {self.config_entry.data[CONF_PREMISE_ID]}>"
 
     async def async_added_to_hass(self) -> None:
-        n_invalid_states = await self.async_delete_invalid_states()
-        _LOGGER.debug(f"{self.entity_id}: cleaned {n_invalid_states} invalid states")
+        integration = await async_get_integration(self.hass, DOMAIN)
+        cleaned = self.coordinator.storage.get(STORAGE_KEY_CLEANED) or {}
+
+        # Cleanup is only urgent on first install, after an upgrade or after a
+        # failed write. Otherwise don't delay the entity, do it once HA is up
+        if cleaned.get(self.unique_id) != str(integration.version):
+            await self._async_clean_invalid_states(str(integration.version))
+
+        else:
+
+            async def _async_at_started(hass: HomeAssistant) -> None:
+                hass.async_create_background_task(
+                    self._async_clean_invalid_states(str(integration.version)),
+                    f"{self.entity_id} invalid states cleanup",
+                )
+
+            self.async_on_remove(async_at_started(self.hass, _async_at_started))
 
         await super().async_added_to_hass()
 
@@ -90,6 +114,20 @@ class SynergyEntity(CoordinatorEntity):
         self.coordinator.unregister_sensor(self)
         await super().async_will_remove_from_hass()
 
+    async def _async_clean_invalid_states(self, version: str) -> None:
+        n_invalid_states = await self.async_delete_invalid_states()
+        _LOGGER.debug(f"{self.entity_id}: cleaned {n_invalid_states} invalid states")
+
+        cleaned = self.coordinator.storage.get(STORAGE_KEY_CLEANED) or {}
+        cleaned[self.unique_id] = version
+        self.coordinator.storage.set(STORAGE_KEY_CLEANED, cleaned)
+
+    def async_mark_invalid_states(self) -> None:
+        """Clean invalid states before the entity is added next time."""
+        cleaned = self.coordinator.storage.get(STORAGE_KEY_CLEANED) or {}
+        if cleaned.pop(self.unique_id, None) is not None:
+            self.coordinator.storage.set(STORAGE_KEY_CLEANED, cleaned)
+
     async def async_delete_invalid_states(self) -> int:
         if getattr(self, "hass", None) is None:
             raise TypeError(f"{self.entity_id} is not added to hass")
@@ -102,7 +140,13 @@ class SynergyEntity(CoordinatorEntity):
 
 
 def _build_entity_unique_id(device_info: DeviceInfo, entity_unique_name: str) -> str:
-    premise_id = dict(device_info["identifiers"])["premise_id"]
+    identifiers = dict(device_info["identifiers"])
+    if "interval_device_id" in identifiers:
+        # Additional interval devices of the premise, already prefixed by premise
+        device_id = identifiers["interval_device_id"]
+        return slugify(f"{device_id}-{entity_unique_name}", separator="-")
+
+    premise_id = identifiers["premise_id"]
     return slugify(f"{premise_id}-{entity_unique_name}", separator="-")
 
 
@@ -24,17 +24,30 @@ from homeassistant.components.recorder import db_schema, statistics
 from homeassistant.core import HomeAssistant, dt_util
 from homeassistant_historical_sensor import recorderutil
 
+from .laststatistics import async_invalidate_last_statistics
+
 _LOGGER = logging.getLogger(__name__)
 
 
 async def async_fix_statistics(
-    hass: HomeAssistant, statistic_metadata: statistics.StatisticMetaData
-) -> None:
+    hass: HomeAssistant,
+    statistic_metadata: statistics.StatisticMetaData,
+    checkpoint: dict | None = None,
+) -> dict | None:
+    """Check statistics and delete broken ones.
+
+    If a checkpoint (as returned by a previous call) is passed only statistics
+    after it are checked, unless metadata or the checkpointed row changed since.
+    Returns the checkpoint for the next call.
+    """
+
     def timestamp_as_local(timestamp):
         return dt_util.as_local(dt_util.utc_from_timestamp(timestamp))
 
     def fn():
+        """Returns the new checkpoint and whether statistics were deleted."""
         fixes_applied = False
+        rows_deleted = False
 
         statistic_id = statistic_metadata["statistic_id"]
         statistic_metadata_has_mean = statistic_metadata.get("has_mean", False)
@@ -53,11 +66,7 @@ async def async_fix_statistics(
 
             if current_metadata is None:
                 _LOGGER.debug(f"{statistic_id}: no statistics found, nothing to fix")
-                return
-
-            statistics_base_stmt = sa.select(db_schema.Statistics).where(
-                db_schema.Statistics.metadata_id == current_metadata.id
-            )
+                return None, False
 
             metadata_needs_fixes = (
                 current_metadata.has_mean != statistic_metadata_has_mean
@@ -76,125 +85,163 @@ async def async_fix_statistics(
                 fixes_applied = True
 
             #
-            # Check for broken points and decreasings
+            # Resume from checkpoint if it's still valid
             #
-            broken_point = None
 
+            since_clauses = []
             prev_sum = 0
-            statistics_iter_stmt = statistics_base_stmt.order_by(
-                db_schema.Statistics.start_ts.asc()
-            )
-
-            for statistic in session.execute(statistics_iter_stmt).scalars():
-                is_broken = False
-                local_start_dt = timestamp_as_local(statistic.start_ts)
 
-                # Check for NULL mean
-                if statistic_metadata_has_mean and statistic.mean is None:
-                    is_broken = True
-                    _LOGGER.debug(
-                        f"{statistic_id}: mean value at {local_start_dt} is NULL"
+            if (
+                checkpoint
+                and not metadata_needs_fixes
+                and checkpoint["metadata_id"] == current_metadata.id
+                and checkpoint["has_mean"] == statistic_metadata_has_mean
+                and checkpoint["has_sum"] == statistic_metadata_has_sum
+            ):
+                checkpoint_row = session.execute(
+                    sa.select(db_schema.Statistics.sum)
+                    .where(db_schema.Statistics.metadata_id == current_metadata.id)
+                    .where(db_schema.Statistics.start_ts == checkpoint["start_ts"])
+                ).first()
+
+                if checkpoint_row is not None and checkpoint_row.sum == checkpoint["row_sum"]:
+                    since_clauses.append(
+                        db_schema.Statistics.start_ts > checkpoint["start_ts"]
                     )
-
-                # Check for NULL sum
-                if statistic_metadata_has_sum and statistic.sum is None:
-                    is_broken = True
+                    prev_sum = checkpoint["max_sum"]
                     _LOGGER.debug(
-                        f"{statistic_id}: sum value at {local_start_dt} is NULL"
+                        f"{statistic_id}: verifying statistics after "
+                        f"{timestamp_as_local(checkpoint['start_ts'])}"
                     )
-
-                # Check for decreasing values in sum
-                if statistic_metadata_has_sum and statistic.sum:
-                    if statistic.sum < prev_sum:
-                        is_broken = True
-                        _LOGGER.debug(
-                            f"{statistic_id}: "
-                            + f"decreasing sum at {local_start_dt} "
-                            + f"{statistic.sum} < {prev_sum} ({statistic!r})"
-                        )
-                    else:
-                        prev_sum = statistic.sum
-
-                # Found anything broken?
-                if is_broken:
-                    broken_point = statistic.start_ts
-                    break
+                else:
+                    _LOGGER.debug(f"{statistic_id}: checkpoint is outdated")
 
             #
-            # Check for broken points (search only for NULLs)
+            # Check for broken points and decreasings
             #
 
-            # clauses_for_additional_or_ = [db_schema.Statistics.state == None]
-            # if statistic_metadata_has_mean:
-            #     clauses_for_additional_or_.append(db_schema.Statistics.mean == None)
-            # if statistic_metadata_has_sum:
-            #     clauses_for_additional_or_.append(db_schema.Statistics.sum == None)
+            # First NULL mean or sum
+            null_clauses = []
+            if statistic_metadata_has_mean:
+                null_clauses.append(db_schema.Statistics.mean == None)
+            if statistic_metadata_has_sum:
+                null_clauses.append(db_schema.Statistics.sum == None)
+
+            broken_points = []
+            if null_clauses:
+                broken_points.append(
+                    session.execute(
+                        sa.select(sa.func.min(db_schema.Statistics.start_ts))
+                        .where(db_schema.Statistics.metadata_id == current_metadata.id)
+                        .where(*since_clauses)
+                        .where(sa.or_(*null_clauses))
+                    ).scalar()
+                )
 
-            # find_broken_point_stmt = (
-            #     sa.select(sa.func.min(db_schema.Statistics.start_ts))
-            #     .where(db_schema.Statistics.metadata_id == current_metadata.id)
-            #     .where(sa.or_(*clauses_for_additional_or_))
-            # )
+            # First decreasing sum (or negative, for the first one). Zero sums are
+            # ignored, as long as sums don't decrease the previous one is also the
+            # highest one
+            if statistic_metadata_has_sum:
+                sums = (
+                    sa.select(
+                        db_schema.Statistics.start_ts,
+                        db_schema.Statistics.sum,
+                        sa.func.lag(db_schema.Statistics.sum)
+                        .over(order_by=db_schema.Statistics.start_ts)
+                        .label("prev_sum"),
+                    )
+                    .where(db_schema.Statistics.metadata_id == current_metadata.id)
+                    .where(*since_clauses)
+                    .where(db_schema.Statistics.sum != None)
+                    .where(db_schema.Statistics.sum != 0)
+                    .subquery()
+                )
+                broken_points.append(
+                    session.execute(
+                        sa.select(sa.func.min(sums.c.start_ts)).where(
+                            sums.c.sum < sa.func.coalesce(sums.c.prev_sum, prev_sum)
+                        )
+                    ).scalar()
+                )
 
-            # broken_point = session.execute(find_broken_point_stmt).scalar()
+            broken_point = min((x for x in broken_points if x is not None), default=None)
 
             #
             # Delete everything after broken point
             #
             if broken_point:
-                invalid_statistics_stmt = statistics_base_stmt.where(
-                    db_schema.Statistics.start_ts >= broken_point
-                )
-                invalid_statistics = (
-                    session.execute(invalid_statistics_stmt).scalars().fetchall()
+                result = session.execute(
+                    sa.delete(db_schema.Statistics)
+                    .where(db_schema.Statistics.metadata_id == current_metadata.id)
+                    .where(db_schema.Statistics.start_ts >= broken_point)
+                    .execution_options(synchronize_session=False)
                 )
-
-                for x in invalid_statistics:
-                    session.delete(x)
-
                 session.commit()
                 fixes_applied = True
+                rows_deleted = rows_deleted or result.rowcount > 0
 
                 _LOGGER.debug(
                     f"{statistic_id}: "
                     f"found broken point at {timestamp_as_local(broken_point)},"
-                    f" deleted {len(invalid_statistics)} statistics"
+                    f" deleted {result.rowcount} statistics"
                 )
 
             #
             # Delete additional statistics
             #
 
-            clauses_for_additional_or_ = [db_schema.Statistics.state == None]
-
-            if statistic_metadata_has_mean:
-                clauses_for_additional_or_.append(db_schema.Statistics.mean == None)
-
-            if statistic_metadata_has_sum:
-                clauses_for_additional_or_.append(db_schema.Statistics.sum == None)
-
-            invalid_statistics_stmt = statistics_base_stmt.where(
-                sa.or_(*clauses_for_additional_or_)
-            )
+            clauses_for_additional_or_ = [db_schema.Statistics.state == None] + null_clauses
 
-            invalid_statistics = (
-                session.execute(invalid_statistics_stmt).scalars().fetchall()
+            result = session.execute(
+                sa.delete(db_schema.Statistics)
+                .where(db_schema.Statistics.metadata_id == current_metadata.id)
+                .where(*since_clauses)
+                .where(sa.or_(*clauses_for_additional_or_))
+                .execution_options(synchronize_session=False)
             )
+            session.commit()
 
-            if invalid_statistics:
-                for o in invalid_statistics:
-                    session.delete(o)
-                session.commit()
+            if result.rowcount:
                 fixes_applied = True
+                rows_deleted = True
 
                 _LOGGER.debug(
                     f"{statistic_id}: "
-                    f"deleted {len(invalid_statistics)} statistics with invalid attributes"
+                    f"deleted {result.rowcount} statistics with invalid attributes"
                 )
 
             if not fixes_applied:
                 _LOGGER.debug(f"{statistic_id}: no problems found")
 
+            #
+            # Everything up to the last row is verified now
+            #
+
+            last_row = session.execute(
+                sa.select(db_schema.Statistics.start_ts, db_schema.Statistics.sum)
+                .where(db_schema.Statistics.metadata_id == current_metadata.id)
+                .order_by(db_schema.Statistics.start_ts.desc())
+                .limit(1)
+            ).first()
+            if last_row is None:
+                return None, rows_deleted
+
+            max_sum = session.execute(
+                sa.select(sa.func.max(db_schema.Statistics.sum))
+                .where(db_schema.Statistics.metadata_id == current_metadata.id)
+                .where(*since_clauses)
+            ).scalar()
+
+            new_checkpoint = {
+                "metadata_id": current_metadata.id,
+                "has_mean": statistic_metadata_has_mean,
+                "has_sum": statistic_metadata_has_sum,
+                "start_ts": last_row.start_ts,
+                "row_sum": last_row.sum,
+                "max_sum": max(prev_sum, max_sum or 0),
+            }
+            return new_checkpoint, rows_deleted
+
             #
             # Recalculate
             #
@@ -236,4 +283,10 @@ async def async_fix_statistics(
             #     )
             # session.commit()
 
-    return await recorder.get_instance(hass).async_add_executor_job(fn)
+    ret, rows_deleted = await recorder.get_instance(hass).async_add_executor_job(fn)
+
+    # Deleted rows could include the last one
+    if rows_deleted:
+        async_invalidate_last_statistics(hass, statistic_metadata["statistic_id"])
+
+    return ret
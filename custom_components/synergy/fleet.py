@@ -0,0 +1,63 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import asyncio
+import hashlib
+from datetime import timedelta
+
+from homeassistant.core import HomeAssistant, callback
+
+from .const import (
+    DATA_FLEET,
+    DOMAIN,
+    FLEET_MAX_CONCURRENT_FETCHES,
+    FLEET_MAX_CONCURRENT_LOGINS,
+)
+
+
+class Fleet:
+    """State shared by the fetches of all config entries.
+
+    Premises are spread across the update window with a deterministic offset, so
+    each one fetches at the same time every day, and the number of concurrent
+    logins and fetches is capped.
+    """
+
+    def __init__(
+        self,
+        max_concurrent_logins: int = FLEET_MAX_CONCURRENT_LOGINS,
+        max_concurrent_fetches: int = FLEET_MAX_CONCURRENT_FETCHES,
+    ):
+        self.login_semaphore = asyncio.Semaphore(max_concurrent_logins)
+        self.fetch_semaphore = asyncio.Semaphore(max_concurrent_fetches)
+
+    @staticmethod
+    def jitter(premise_id: str | int, span: timedelta) -> timedelta:
+        """Offset within `span` for `premise_id`, stable across restarts."""
+        digest = hashlib.sha256(str(premise_id).encode()).digest()
+        fraction = int.from_bytes(digest[:8], "big") / 2**64
+        return timedelta(seconds=int(span.total_seconds() * fraction))
+
+
+@callback
+def async_get_fleet(hass: HomeAssistant) -> Fleet:
+    hass.data[DOMAIN] = hass.data.get(DOMAIN, {})
+    if DATA_FLEET not in hass.data[DOMAIN]:
+        hass.data[DOMAIN][DATA_FLEET] = Fleet()
+
+    return hass.data[DOMAIN][DATA_FLEET]
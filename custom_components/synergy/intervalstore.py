@@ -0,0 +1,275 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import logging
+import math
+import mmap
+import os
+import struct
+from array import array
+from pathlib import Path
+
+from .series import ENGINE_AUTO, INTERVAL_LENGTH, IntervalSeries, _use_numpy, np
+
+# magic, interval number of the first value, number of values
+_HEADER = struct.Struct("<8sqq")
+_MAGIC = b"SYNIS001"
+_ITEM_SIZE = 8
+
+# Files grow by (at least) one year of intervals at a time
+_GROW_LENGTH = 366 * 24 * 3600 // INTERVAL_LENGTH
+
+_NAN_BYTES = struct.pack("<d", math.nan)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class IntervalStoreError(Exception):
+    pass
+
+
+class MetricFile:
+    """Memory-mapped fixed-width file of float64 values, one per interval.
+
+    Value `i` belongs to interval number `first + i`, where the interval number
+    of a timestamp is `timestamp // INTERVAL_LENGTH`. NaN means not published.
+    Opening a file only reads its header, reads return views of the mapping.
+    Views are only valid until the next write, which can revise or move values.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+
+        exists = path.exists()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if not exists or os.fstat(self._fd).st_size < _HEADER.size:
+            os.ftruncate(self._fd, _HEADER.size + _GROW_LENGTH * _ITEM_SIZE)
+            os.pwrite(self._fd, _HEADER.pack(_MAGIC, 0, 0), 0)
+
+        if (os.fstat(self._fd).st_size - _HEADER.size) % _ITEM_SIZE:
+            os.close(self._fd)
+            raise IntervalStoreError(f"{path}: not an interval store file")
+
+        self._map()
+        magic, self.first, self.length = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC:
+            self.close()
+            raise IntervalStoreError(f"{path}: not an interval store file")
+
+        if self.length < 0 or self.length > self.capacity:
+            self.close()
+            raise IntervalStoreError(f"{path}: truncated ({self.length} values in header)")
+
+    @property
+    def capacity(self) -> int:
+        return (len(self._mm) - _HEADER.size) // _ITEM_SIZE
+
+    def _map(self) -> None:
+        self._mm = mmap.mmap(self._fd, 0)
+        self._values = memoryview(self._mm)[_HEADER.size :].cast("d")
+
+    def _grow(self, length: int) -> None:
+        if length <= self.capacity:
+            return
+
+        length = max(length, self.capacity + _GROW_LENGTH)
+        os.ftruncate(self._fd, _HEADER.size + length * _ITEM_SIZE)
+
+        # Views returned by read() keep the old mapping alive until released
+        self._values.release()
+        self._map()
+
+    def read(self, start: int, end: int) -> tuple[int, memoryview]:
+        """Zero-copy view of the values of intervals [start, end).
+
+        The range is clamped to the stored one, returns the interval number of the
+        first value and the view. The view must not be used after a write.
+        """
+        start = max(start, self.first)
+        end = min(end, self.first + self.length)
+        if end <= start:
+            return start, self._values[0:0]
+
+        return start, self._values[start - self.first : end - self.first]
+
+    def write(self, start: int, values) -> None:
+        """Write values (a buffer of doubles) starting at interval `start`.
+
+        Writing after the stored range is an append, the gap (if any) is filled
+        with NaN. Writing before it needs to move the whole file.
+        """
+        if not len(values):
+            return
+
+        if not self.length:
+            self.first = start
+
+        elif start < self.first:
+            shift = self.first - start
+            self._grow(self.length + shift)
+            self._values[shift : shift + self.length] = array("d", self._values[: self.length].tobytes())
+            self._fill_nan(0, shift)
+            self.first = start
+            self.length = self.length + shift
+
+        offset = start - self.first
+        end = offset + len(values)
+        self._grow(end)
+
+        if offset > self.length:
+            self._fill_nan(self.length, offset)
+
+        self._values[offset:end] = values
+        self.length = max(self.length, end)
+        _HEADER.pack_into(self._mm, 0, _MAGIC, self.first, self.length)
+
+    def _fill_nan(self, start: int, end: int) -> None:
+        self._values[start:end] = array("d", _NAN_BYTES * (end - start))
+
+    def flush(self) -> None:
+        self._mm.flush()
+
+    def close(self) -> None:
+        self._values.release()
+        try:
+            self._mm.close()
+        except BufferError:
+            # There are still views in use, the mapping goes away with them
+            pass
+        os.close(self._fd)
+
+
+class IntervalStore:
+    """Long term interval history, one MetricFile per metric under `path`.
+
+    All methods do blocking IO, run them in an executor. It's only a cache of
+    fetched data, broken files are moved aside and started again.
+    """
+
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._files: dict[str, MetricFile] = {}
+        for file in self.path.glob("*.f64"):
+            self._files[file.stem] = self._open(file)
+
+    @staticmethod
+    def _open(path: Path) -> MetricFile:
+        try:
+            return MetricFile(path)
+        except IntervalStoreError as e:
+            broken = path.with_suffix(".broken")
+            _LOGGER.warning(f"{e}, moved to {broken.name}")
+            os.replace(path, broken)
+            return MetricFile(path)
+
+    @property
+    def metrics(self) -> list[str]:
+        return list(self._files)
+
+    def _file(self, name: str) -> MetricFile:
+        if name not in self._files:
+            self._files[name] = self._open(self.path / f"{name}.f64")
+
+        return self._files[name]
+
+    def write(self, series: IntervalSeries, engine: str = ENGINE_AUTO) -> None:
+        """Store all columns of `series`, invalid intervals are stored as NaN."""
+        if not series:
+            return
+
+        start = series.start // INTERVAL_LENGTH
+        for name in series.columns:
+            column, mask = series.column(name), series.mask(name)
+            if _use_numpy(engine):
+                values = np.where(
+                    np.frombuffer(mask, dtype=np.uint8).astype(bool),
+                    np.frombuffer(column, dtype=np.float64),
+                    np.nan,
+                )
+            else:
+                values = array(
+                    "d", (x if valid else math.nan for x, valid in zip(column, mask))
+                )
+
+            self._file(name).write(start, memoryview(values).cast("B").cast("d"))
+
+        for file in self._files.values():
+            file.flush()
+
+    def read(self, name: str, start: int, end: int) -> tuple[int, memoryview]:
+        """Zero-copy view of metric `name` between timestamps [start, end).
+
+        Returns the timestamp of the first value and the view, which must not be
+        used after a write.
+        """
+        first, view = self._file(name).read(
+            math.ceil(start / INTERVAL_LENGTH), math.ceil(end / INTERVAL_LENGTH)
+        )
+        return first * INTERVAL_LENGTH, view
+
+    def read_series(
+        self, start: int, end: int, engine: str = ENGINE_AUTO
+    ) -> IntervalSeries:
+        """Build a series for [start, end) from the files.
+
+        Columns are copied once from the mapping, the series outlives the call and
+        later writes (revisions or values written before the stored range) would
+        change views under it.
+        """
+        if not self._files:
+            return IntervalSeries.empty()
+
+        # Align all metrics to the same range
+        first = max(start, min(self.read(name, start, end)[0] for name in self._files))
+        last = first
+        for name in self._files:
+            ts, view = self.read(name, first, end)
+            last = max(last, ts + len(view) * INTERVAL_LENGTH)
+
+        if last <= first:
+            return IntervalSeries.empty()
+
+        length = (last - first) // INTERVAL_LENGTH
+        columns = {}
+        masks = {}
+        for name in self._files:
+            ts, view = self.read(name, first, last)
+            if ts != first or len(view) != length:
+                # Metric doesn't cover the whole range, pad it with NaN
+                column = array("d", _NAN_BYTES * length)
+                offset = (ts - first) // INTERVAL_LENGTH
+                memoryview(column)[offset : offset + len(view)] = view
+            else:
+                column = array("d", view.tobytes())
+
+            columns[name] = column
+            if _use_numpy(engine):
+                masks[name] = array(
+                    "B", (~np.isnan(np.frombuffer(column, dtype=np.float64))).astype(np.uint8).tobytes()
+                )
+            else:
+                masks[name] = array("B", [x == x for x in column])
+
+        return IntervalSeries(first, columns, masks)
+
+    def close(self) -> None:
+        for file in self._files.values():
+            file.close()
+
+        self._files = {}
@@ -0,0 +1,128 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import re
+from array import array
+from collections.abc import Iterable
+
+# Longest tail kept between chunks while looking for a key, enough for
+# '"<key>"' plus some whitespace and the ':' and '[' separators
+_MAX_SEPARATOR_LENGTH = 32
+
+
+class DecodeError(Exception):
+    pass
+
+
+class IntervalDataDecoder:
+    """Incremental decoder for getHalfHourlyElecIntervalData responses.
+
+    Only arrays of numbers (or null) under the requested keys are decoded, they
+    are written straight into `array('d')` buffers with a `array('B')` validity
+    mask. Everything else in the document is skipped without being parsed, so
+    memory usage is bounded by the decoded columns and the chunk size.
+    """
+
+    def __init__(self, keys: Iterable[str]):
+        keys = list(keys)
+        self._key_re = re.compile(
+            rb'"('
+            + b"|".join(re.escape(key.encode()) for key in keys)
+            + rb')"\s*:\s*\['
+        )
+        self._tail_length = max(len(key) for key in keys) + _MAX_SEPARATOR_LENGTH
+
+        self._buffer = b""
+        self._current: str | None = None
+        self._values = {key: array("d") for key in keys}
+        self._masks = {key: array("B") for key in keys}
+        self._found: set[str] = set()
+
+    def feed(self, chunk: bytes) -> None:
+        buffer = self._buffer + chunk
+
+        while buffer:
+            if self._current is None:
+                m = self._key_re.search(buffer)
+                if m is None:
+                    # Keep the tail in case a key is split between chunks
+                    buffer = buffer[-self._tail_length :]
+                    break
+
+                self._current = m.group(1).decode()
+                self._found.add(self._current)
+                buffer = buffer[m.end() :]
+
+            else:
+                end = buffer.find(b"]")
+                if end == -1:
+                    # Decode up to the last complete token
+                    sep = buffer.rfind(b",")
+                    if sep == -1:
+                        break
+
+                    self._decode_tokens(buffer[:sep])
+                    buffer = buffer[sep + 1 :]
+                    break
+
+                self._decode_tokens(buffer[:end])
+                self._current = None
+                buffer = buffer[end + 1 :]
+
+        self._buffer = buffer
+
+    def close(self) -> dict[str, tuple[array, array]]:
+        """Return (values, mask) for each key. Missing values are stored as 0."""
+        if self._current is not None:
+            raise DecodeError(f"Truncated response while decoding '{self._current}'")
+
+        if not self._found:
+            raise DecodeError("No interval data found in response")
+
+        return {key: (self._values[key], self._masks[key]) for key in self._found}
+
+    def _decode_tokens(self, data: bytes) -> None:
+        if not data.strip():
+            return
+
+        tokens = data.split(b",")
+        values = self._values[self._current]
+        mask = self._masks[self._current]
+
+        # Fast path, float() accepts bytes and ignores surrounding whitespace
+        if b"null" not in data:
+            try:
+                values.extend(map(float, tokens))
+            except ValueError as e:
+                raise DecodeError(f"Invalid value in '{self._current}': {e}") from e
+            mask.extend(b"\x01" * len(tokens))
+            return
+
+        for token in tokens:
+            token = token.strip()
+            if token == b"null":
+                values.append(0)
+                mask.append(0)
+            else:
+                try:
+                    values.append(float(token))
+                except ValueError as e:
+                    raise DecodeError(
+                        f"Invalid value in '{self._current}': {token!r}"
+                    ) from e
+                mask.append(1)
@@ -0,0 +1,105 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import logging
+from typing import TypedDict
+
+from collections.abc import Callable
+
+from homeassistant.const import (
+    ATTR_DOMAIN,
+    ATTR_SERVICE,
+    ATTR_SERVICE_DATA,
+    EVENT_CALL_SERVICE,
+)
+from homeassistant.core import Event, HomeAssistant, callback
+
+from .const import DATA_LAST_STATISTICS, DOMAIN
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class LastStatistic(TypedDict):
+    start: float
+    sum: float
+
+
+@callback
+def _get_cache(hass: HomeAssistant) -> dict[str, LastStatistic]:
+    hass.data[DOMAIN] = hass.data.get(DOMAIN, {})
+    return hass.data[DOMAIN].setdefault(DATA_LAST_STATISTICS, {})
+
+
+@callback
+def async_get_last_statistic(
+    hass: HomeAssistant, statistic_id: str
+) -> LastStatistic | None:
+    """Last (start, sum) written by this integration, None if unknown."""
+    return _get_cache(hass).get(statistic_id)
+
+
+@callback
+def async_set_last_statistic(
+    hass: HomeAssistant, statistic_id: str, start: float, sum_: float
+) -> None:
+    # Like the recorder, keep the newest one. Older rows (ex. backfills) don't
+    # change the last statistic
+    cache = _get_cache(hass)
+    current = cache.get(statistic_id)
+    if current is None or start >= current["start"]:
+        cache[statistic_id] = LastStatistic(start=start, sum=sum_)
+
+
+@callback
+def async_invalidate_last_statistics(
+    hass: HomeAssistant, statistic_id: str | None = None
+) -> None:
+    """Forget cached statistics, must be called after modifying them externally."""
+    cache = _get_cache(hass)
+    if statistic_id is None:
+        cache.clear()
+    else:
+        cache.pop(statistic_id, None)
+
+    _LOGGER.debug(f"{statistic_id or 'all statistics'}: last statistics invalidated")
+
+
+@callback
+def async_track_statistics_imports(hass: HomeAssistant) -> Callable[[], None]:
+    """Invalidate cached statistics modified by recorder services (ex. imports).
+
+    Changes made from the websocket API (ex. adjusting a sum from the developer
+    tools) are not visible here, the verify_statistics service resyncs them.
+    """
+
+    @callback
+    def _async_service_called(event: Event) -> None:
+        service = event.data.get(ATTR_SERVICE, "")
+        if (
+            event.data.get(ATTR_DOMAIN) != "recorder"
+            or "statistics" not in service
+            or service.startswith("get_")
+        ):
+            return
+
+        statistic_id = (event.data.get(ATTR_SERVICE_DATA) or {}).get("statistic_id")
+        async_invalidate_last_statistics(
+            hass, statistic_id if isinstance(statistic_id, str) else None
+        )
+
+    return hass.bus.async_listen(EVENT_CALL_SERVICE, _async_service_called)
@@ -0,0 +1,81 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import math
+from datetime import date, datetime, time, timedelta
+
+from .const import (
+    PUBLICATION_MAX_OBSERVATIONS,
+    PUBLICATION_MIN_OBSERVATIONS,
+    PUBLICATION_QUANTILE,
+)
+from .series import INTERVAL_LENGTH
+from .SynergyDataFetcher import SYNERGY_TIMEZONE
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def last_complete_day(watermark: int | None) -> date | None:
+    """Last day whose intervals are all up to `watermark` (an interval start)."""
+    if watermark is None:
+        return None
+
+    day_after = datetime.fromtimestamp(watermark + INTERVAL_LENGTH, SYNERGY_TIMEZONE).date()
+    return day_after - timedelta(days=1)
+
+
+class PublicationModel:
+    """Distribution of the (Synergy) time of day new days of data appear at.
+
+    Each observation is the minute of the day when a new complete day was first
+    seen, shortly after it was seen missing. Since it's only known that data was
+    published between both, they are upper bounds of the real publication time.
+    """
+
+    def __init__(self, observations: list[int] | None = None):
+        self._observations = list(observations or [])
+
+    def dump(self) -> list[int]:
+        return list(self._observations)
+
+    def record(self, seen: datetime) -> None:
+        seen = seen.astimezone(SYNERGY_TIMEZONE)
+        self._observations.append(seen.hour * 60 + seen.minute)
+        self._observations = self._observations[-PUBLICATION_MAX_OBSERVATIONS:]
+
+    def learned_time(self, quantile: float = PUBLICATION_QUANTILE) -> time | None:
+        """Time of day (in SYNERGY_TIMEZONE) by which data was published with
+        probability `quantile`, None if there are not enough observations."""
+        if len(self._observations) < PUBLICATION_MIN_OBSERVATIONS:
+            return None
+
+        # Times of day wrap around midnight, start counting after the largest gap
+        # between observations so ex. 23:50 comes before 00:10
+        minutes = sorted(self._observations)
+        gaps = [
+            (minutes[(idx + 1) % len(minutes)] - minutes[idx]) % MINUTES_PER_DAY
+            for idx in range(len(minutes))
+        ]
+        first = (gaps.index(max(gaps)) + 1) % len(minutes)
+        unwrapped = [
+            x if x >= minutes[first] else x + MINUTES_PER_DAY
+            for x in minutes[first:] + minutes[:first]
+        ]
+
+        minute = unwrapped[math.ceil(quantile * len(unwrapped)) - 1] % MINUTES_PER_DAY
+        return time(hour=minute // 60, minute=minute % 60, tzinfo=SYNERGY_TIMEZONE)
@@ -0,0 +1,162 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import logging
+from collections.abc import Callable
+from datetime import datetime, timedelta
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.event import async_track_point_in_time
+from homeassistant.util import dt as dt_util
+
+from .const import (
+    MIN_FETCH_INTERVAL,
+    PUBLICATION_FETCH_SPREAD,
+    PUBLICATION_PROBE_INTERVAL,
+)
+from .datacoordinator import SynergyCoordinator
+from .fleet import async_get_fleet
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class FetchScheduler:
+    """Refresh the coordinator only when its barrier allows it.
+
+    Instead of polling and getting denied by the barrier, a single timer is armed
+    at the next allowed time. It's rearmed after every coordinator update (ours or
+    requested by someone else).
+
+    Fetches waiting for the update window are delayed by a per-premise offset
+    within the first half of it, so all premises don't fetch at once.
+
+    While the session is alive and the previous day is missing, a second timer
+    probes for it (at any time, probes don't login) to learn when it's published.
+    """
+
+    def __init__(
+        self, hass: HomeAssistant, coordinator: SynergyCoordinator, premise_id: str
+    ):
+        self._hass = hass
+        self._coordinator = coordinator
+        self._premise_id = premise_id
+        self._unsub_timer: Callable[[], None] | None = None
+        self._unsub_listener: Callable[[], None] | None = None
+        self._unsub_probe: Callable[[], None] | None = None
+        self._next_fetch: datetime | None = None
+        self._last_fetch: datetime | None = None
+
+    @property
+    def next_fetch(self) -> datetime | None:
+        return self._next_fetch if self._unsub_timer else None
+
+    @callback
+    def async_start(self) -> None:
+        self._unsub_listener = self._coordinator.async_add_listener(self.async_schedule)
+        self.async_schedule()
+
+    @callback
+    def async_stop(self) -> None:
+        self._cancel_timer()
+        self._cancel_probe()
+        if self._unsub_listener is not None:
+            self._unsub_listener()
+            self._unsub_listener = None
+
+    @callback
+    def async_schedule(self) -> None:
+        self._cancel_timer()
+
+        barrier = self._coordinator.barrier
+        now = dt_util.utcnow()
+
+        self._next_fetch = barrier.next_allowed(now)
+
+        # Spread fetches waiting for the barrier (retries and probes are allowed
+        # right away and not delayed). Keep the offset only if it's still allowed
+        if self._next_fetch > now:
+            start_hour, end_hour = barrier.allowed_window_hours
+            span = timedelta(hours=end_hour - start_hour + 1) / 2
+
+            # Once the publication time is learned, fetch just after it instead of
+            # anywhere in its hour
+            publication_time = self._coordinator.publication_time
+            if publication_time is not None:
+                local = dt_util.as_local(self._next_fetch)
+                anchored = dt_util.as_utc(
+                    datetime.combine(local.date(), publication_time, tzinfo=local.tzinfo)
+                )
+                if anchored > self._next_fetch and barrier.next_allowed(anchored) == anchored:
+                    self._next_fetch = anchored
+                span = PUBLICATION_FETCH_SPREAD
+
+            jittered = self._next_fetch + async_get_fleet(self._hass).jitter(
+                self._premise_id, span
+            )
+            if barrier.next_allowed(jittered) == jittered:
+                self._next_fetch = jittered
+
+        # Don't hammer the API if the barrier allows to retry right away
+        if self._last_fetch is not None:
+            self._next_fetch = max(self._next_fetch, self._last_fetch + MIN_FETCH_INTERVAL)
+
+        self._unsub_timer = async_track_point_in_time(
+            self._hass, self._async_fetch, self._next_fetch
+        )
+        _LOGGER.debug(f"next fetch scheduled at {dt_util.as_local(self._next_fetch)}")
+
+        self._schedule_probe()
+
+    @callback
+    def _schedule_probe(self) -> None:
+        if self._unsub_probe is not None or not self._coordinator.publication_probe_needed:
+            return
+
+        next_probe = dt_util.utcnow() + PUBLICATION_PROBE_INTERVAL
+        self._unsub_probe = async_track_point_in_time(
+            self._hass, self._async_probe, next_probe
+        )
+        _LOGGER.debug(f"next publication probe at {dt_util.as_local(next_probe)}")
+
+    async def _async_probe(self, now: datetime) -> None:
+        self._unsub_probe = None
+        if await self._coordinator.async_probe_publication():
+            # The barrier is open now, fetch the new day
+            self.async_schedule()
+        else:
+            self._schedule_probe()
+
+    async def _async_fetch(self, now: datetime) -> None:
+        self._unsub_timer = None
+        self._last_fetch = now
+        await self._coordinator.async_refresh()
+        # In case the refresh didn't notify listeners
+        if self._unsub_timer is None:
+            self.async_schedule()
+
+    @callback
+    def _cancel_timer(self) -> None:
+        if self._unsub_timer is not None:
+            self._unsub_timer()
+            self._unsub_timer = None
+
+    @callback
+    def _cancel_probe(self) -> None:
+        if self._unsub_probe is not None:
+            self._unsub_probe()
+            self._unsub_probe = None
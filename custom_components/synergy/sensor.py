@@ -28,7 +28,7 @@
 import itertools
 import logging
 from collections.abc import Callable
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import Any
 
 from homeassistant.components import recorder
@@ -53,7 +53,8 @@ from homeassistant.helpers.typing import DiscoveryInfoType
 from homeassistant.util import dt as dtutil
 from homeassistant_historical_sensor import HistoricalSensor, HistoricalState
 
-from .const import DOMAIN
+from . import SynergyIntervalDeviceInfo
+from .const import CONF_PREMISE_ID, DOMAIN, STORAGE_KEY_VERIFIED, STORAGE_KEY_WRITTEN
 from .datacoordinator import (
     DATA_ATTR_HISTORICAL_CONSUMPTION,
     DATA_ATTR_HISTORICAL_GENERATION,
@@ -61,10 +62,15 @@ from .datacoordinator import (
 )
 from .entity import SynergyEntity
 from .fixes import async_fix_statistics
+from .laststatistics import (
+    async_get_last_statistic,
+    async_invalidate_last_statistics,
+    async_set_last_statistic,
+)
+from .series import IntervalSeries, hourly_sums
 
 PLATFORM = "sensor"
 
-MAINLAND_SPAIN_ZONEINFO = dtutil.zoneinfo.ZoneInfo("Europe/Madrid")
 _LOGGER = logging.getLogger(__name__)
 
 
@@ -83,13 +89,124 @@ _LOGGER = logging.getLogger(__name__)
 
 
 class HistoricalSensorMixin(HistoricalSensor):
+    SYNERGY_COLUMN = ""
+
+    _series_override: IntervalSeries | None = None
+    _pending_indexes: list[int] | None = None
+
+    @property
+    def historical_states(self):
+        series = self._series_override
+        if series is not None:
+            if not series:
+                return []
+
+            return _build_historical_states(
+                series,
+                self.SYNERGY_COLUMN,
+                series.datetimes(dtutil.DEFAULT_TIME_ZONE),
+            )
+
+        def fn():
+            data = self.coordinator.series(self.interval_device_id)
+            if not data:
+                return []
+
+            return _build_historical_states(
+                data,
+                self.SYNERGY_COLUMN,
+                self.coordinator.local_datetimes(self.interval_device_id),
+            )
+
+        # States are only rebuilt when coordinator data changes
+        hist_states = self.coordinator.memoize(
+            ("historical_states", self.SYNERGY_COLUMN, self.interval_device_id), fn
+        )
+        if self._pending_indexes is not None:
+            return [hist_states[idx] for idx in self._pending_indexes]
+
+        return list(hist_states)
+
+    async def async_write_ha_historical_states(self) -> None:
+        data = self.coordinator.series(self.interval_device_id)
+        if self._series_override is not None or not data:
+            await super().async_write_ha_historical_states()
+            return
+
+        # Only intervals after the last written one or in revised days are written
+        written = self.coordinator.storage.get(STORAGE_KEY_WRITTEN) or {}
+        sensor_written = written.get(self.unique_id) or {"watermark": None, "days": {}}
+        digests = self.coordinator.day_digests(self.SYNERGY_COLUMN, self.interval_device_id)
+
+        pending: set[int] = set()
+        if sensor_written["watermark"] is None:
+            pending.update(range(len(data)))
+        else:
+            pending.update(range(data.index(sensor_written["watermark"] + 1), len(data)))
+
+        for day_start, day_end, digest in digests:
+            if sensor_written["days"].get(str(day_start)) != digest:
+                pending.update(range(data.index(day_start), data.index(day_end)))
+
+        if not pending:
+            _LOGGER.debug(f"{self.entity_id}: nothing new to write")
+            return
+
+        _LOGGER.debug(f"{self.entity_id}: writing {len(pending)} of {len(data)} states")
+        self._pending_indexes = sorted(pending)
+        try:
+            await super().async_write_ha_historical_states()
+        except Exception:
+            # Some states could have been written, and the cached last statistic
+            # could be one that never reached the recorder
+            self.async_mark_invalid_states()
+            async_invalidate_last_statistics(self.hass, self.statistic_id)
+            raise
+        finally:
+            self._pending_indexes = None
+
+        last_ts = data.timestamp(len(data) - 1)
+        written[self.unique_id] = {
+            "watermark": max(last_ts, sensor_written["watermark"] or last_ts),
+            "days": {str(day_start): digest for day_start, _, digest in digests},
+        }
+        self.coordinator.storage.set(STORAGE_KEY_WRITTEN, written)
+
     @callback
     def _handle_coordinator_update(self) -> None:
+        # Listeners are notified even if the update was denied. Newer states written
+        # now would make the recorder reject the remaining backfill chunks, the
+        # backfill writes its own ones
+        if self.coordinator.backfill_in_progress:
+            return
+
         self.hass.add_job(self.async_write_ha_historical_states())
 
     def async_update_historical(self) -> None:
         pass
 
+    async def async_write_historical_series(self, series: IntervalSeries) -> None:
+        """Write states from a series other than the coordinator data (ex. backfill)"""
+        self._series_override = series
+        try:
+            await self.async_write_ha_historical_states()
+        except Exception:
+            self.async_mark_invalid_states()
+            async_invalidate_last_statistics(self.hass, self.statistic_id)
+            raise
+        finally:
+            self._series_override = None
+
+
+def _build_historical_states(
+    series: IntervalSeries, column: str, datetimes: list[datetime]
+) -> list[HistoricalState]:
+    # Not published intervals are written as 0 (whatever the column holds)
+    return [
+        HistoricalState(state=value if valid else 0, dt=dt)
+        for dt, value, valid in zip(datetimes, series.column(column), series.mask(column))
+    ]
+
 
 class StatisticsMixin(HistoricalSensor):
     @property
@@ -110,7 +227,25 @@ class StatisticsMixin(HistoricalSensor):
         #
         # FIXME: Remove in future 3.0 series.
         #
-        await async_fix_statistics(self.hass, self.get_statistic_metadata())
+        await self.async_verify_statistics()
+
+    async def async_verify_statistics(self, full: bool = False) -> None:
+        """Fix broken statistics, only the ones after the last verified one unless
+        `full` is set."""
+        storage = self.coordinator.storage
+        checkpoints = storage.get(STORAGE_KEY_VERIFIED) or {}
+
+        checkpoint = await async_fix_statistics(
+            self.hass,
+            self.get_statistic_metadata(),
+            checkpoint=None if full else checkpoints.get(self.statistic_id),
+        )
+
+        if checkpoint is None:
+            checkpoints.pop(self.statistic_id, None)
+        else:
+            checkpoints[self.statistic_id] = checkpoint
+        storage.set(STORAGE_KEY_VERIFIED, checkpoints)
 
     async def async_calculate_statistic_data(
         self, hist_states: list[HistoricalState], *, latest: dict | None
@@ -128,20 +263,7 @@ class StatisticsMixin(HistoricalSensor):
             )
 
         #
-        # Group historical states by hour block
-        #
-
-        def hour_block_for_hist_state(hist_state: HistoricalState) -> datetime:
-            # XX:00:00 states belongs to previous hour block
-            if hist_state.dt.minute == 0 and hist_state.dt.second == 0:
-                dt = hist_state.dt - timedelta(hours=1)
-                return dt.replace(minute=0, second=0, microsecond=0)
-
-            else:
-                return hist_state.dt.replace(minute=0, second=0, microsecond=0)
-
-        #
-        # Ignore supplied 'lastest' and fetch again from recorder
+        # Ignore supplied 'lastest' and use our own (or fetch again from recorder)
         # FIXME: integrate into homeassistant_historical_sensor and remove
         #
 
@@ -174,9 +296,11 @@ class StatisticsMixin(HistoricalSensor):
                 )
                 raise
 
-        latest = await recorder.get_instance(self.hass).async_add_executor_job(
-            get_last_statistics
-        )
+        latest = async_get_last_statistic(self.hass, self.statistic_id)
+        if latest is None:
+            latest = await recorder.get_instance(self.hass).async_add_executor_job(
+                get_last_statistics
+            )
 
         #
         # Get last sum sum from latest
@@ -206,24 +330,31 @@ class StatisticsMixin(HistoricalSensor):
         # Calculate statistic data
         #
 
-        ret = []
-
-        for dt, collection_it in itertools.groupby(
-            hist_states, key=hour_block_for_hist_state
-        ):
-            collection = list(collection_it)
-
-            # hour_mean = statistics.mean([x.state for x in collection])
-            hour_accumulated = sum([x.state for x in collection])
-            total_accumulated = total_accumulated + hour_accumulated
+        # Group historical states by hour block, XX:00:00 states belong to the
+        # previous one
+        blocks, hour_sums = hourly_sums(
+            [x.dt.timestamp() for x in hist_states],
+            [int(x.dt.utcoffset().total_seconds()) for x in hist_states],
+            [x.state for x in hist_states],
+        )
+        totals = itertools.accumulate(hour_sums, initial=total_accumulated)
+        next(totals)
+
+        tz = hist_states[0].dt.tzinfo if hist_states else None
+        ret = [
+            StatisticData(
+                start=datetime.fromtimestamp(block, tz),
+                state=hour_accumulated,
+                # mean=hour_mean,
+                sum=total,
+            )
+            for block, hour_accumulated, total in zip(blocks, hour_sums, totals)
+        ]
 
-            ret.append(
-                StatisticData(
-                    start=dt,
-                    state=hour_accumulated,
-                    # mean=hour_mean,
-                    sum=total_accumulated,
-                )
+        # Next calculation starts from here without asking the recorder
+        if ret:
+            async_set_last_statistic(
+                self.hass, self.statistic_id, float(blocks[-1]), ret[-1]["sum"]
             )
 
         return ret
@@ -234,6 +365,7 @@ class HistoricalConsumption(
 ):
     SYNERGY_PLATFORM = PLATFORM
     SYNERGY_ENTITY_NAME = "Historical Consumption"
+    SYNERGY_COLUMN = "total_kwh"
     # SYNERGY_DATA_SETS = [DataSetType.HISTORICAL_CONSUMPTION]
 
     def __init__(self, *args, **kwargs):
@@ -256,25 +388,13 @@ class HistoricalConsumption(
         #
         # self._attr_state_class = SensorStateClass.TOTAL
 
-    @property
-    def historical_states(self):
-        if self.coordinator.data is None:
-            return []
-
-        hist_states = [
-            HistoricalState(
-                state=data["total_kwh"],
-                dt=dtutil.as_local(data['timestamp']))
-            for data in self.coordinator.data
-        ]
-        return hist_states
-
 
 class HistoricalGeneration(
     StatisticsMixin, HistoricalSensorMixin, SynergyEntity, SensorEntity
 ):
     SYNERGY_PLATFORM = PLATFORM
     SYNERGY_ENTITY_NAME = "Historical Generation"
+    SYNERGY_COLUMN = "generation_kwh"
     # SYNERGY_DATA_SETS = [DataSetType.HISTORICAL_GENERATION]
 
     def __init__(self, *args, **kwargs):
@@ -297,19 +417,6 @@ class HistoricalGeneration(
         #
         # self._attr_state_class = SensorStateClass.TOTAL
 
-    @property
-    def historical_states(self):
-        if self.coordinator.data is None:
-            return []
-
-        hist_states = [
-            HistoricalState(
-                state=data["generation_kwh"],
-                dt=dtutil.as_local(data['timestamp']))
-            for data in self.coordinator.data
-        ]
-        return hist_states
-
 
 async def async_setup_entry(
     hass: HomeAssistant,
@@ -329,6 +436,38 @@ async def async_setup_entry(
     ]
     async_add_devices(sensors)
 
+    # Other interval devices of the premise (ex. solar or controlled load meters)
+    # get their own device. They are known after account metadata is loaded
+    added: set[str] = set()
+
+    @callback
+    def _async_add_interval_devices() -> None:
+        premise_id = config_entry.data[CONF_PREMISE_ID]
+        sensors = []
+        for device_id in coordinator.api.device_ids[1:]:
+            if device_id in added:
+                continue
+
+            added.add(device_id)
+            interval_device_info = SynergyIntervalDeviceInfo(premise_id, device_id)
+            sensors.extend(
+                sensor_cls(
+                    config_entry=config_entry,
+                    device_info=interval_device_info,
+                    coordinator=coordinator,
+                    interval_device_id=device_id,
+                )
+                for sensor_cls in (HistoricalConsumption, HistoricalGeneration)
+            )
+
+        if sensors:
+            async_add_devices(sensors)
+
+    _async_add_interval_devices()
+    config_entry.async_on_unload(
+        coordinator.async_add_listener(_async_add_interval_devices)
+    )
+
 
 async def async_get_last_state_safe(
     entity: RestoreEntity, convert_fn: Callable[[Any], Any]
@@ -0,0 +1,340 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import functools
+import math
+import operator
+from array import array
+from collections.abc import Iterable, Iterator
+from datetime import datetime, timedelta, tzinfo
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+INTERVAL_LENGTH = 30 * 60
+
+# Timezones don't change their offset twice within a day, if the offset is the
+# same at both ends of a day long block there is no transition in between
+_DATETIMES_BLOCK = 24 * 3600
+
+ENGINE_AUTO = "auto"
+ENGINE_NUMPY = "numpy"
+ENGINE_PYTHON = "python"
+
+
+def _use_numpy(engine: str) -> bool:
+    if engine == ENGINE_NUMPY and np is None:
+        raise ValueError("numpy engine requested but numpy is not available")
+
+    if engine not in (ENGINE_AUTO, ENGINE_NUMPY, ENGINE_PYTHON):
+        raise ValueError(f"Unknown engine '{engine}'")
+
+    return engine != ENGINE_PYTHON and np is not None
+
+
+def hourly_sums(
+    timestamps: Iterable[float],
+    offsets: Iterable[int],
+    values: Iterable[float],
+    engine: str = ENGINE_AUTO,
+) -> tuple[list[int], list[float]]:
+    """Sum values by (local) hour block.
+
+    `offsets` are the UTC offsets (in seconds) of each timestamp. A value at XX:00
+    belongs to the previous hour block, like intervals ending at XX:00. Like
+    itertools.groupby only consecutive values are grouped, so input should be
+    sorted. Returns the start timestamp and the sum of each block.
+    """
+    if _use_numpy(engine):
+        ts = np.floor(np.fromiter(timestamps, dtype=np.float64)).astype(np.int64)
+        if not len(ts):
+            return [], []
+
+        off = np.fromiter(offsets, dtype=np.int64, count=len(ts))
+        keys = (ts + off - 1) // 3600 * 3600 - off
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+        sums = np.add.reduceat(np.fromiter(values, dtype=np.float64, count=len(ts)), starts)
+        return keys[starts].tolist(), sums.tolist()
+
+    blocks: list[int] = []
+    sums: list[float] = []
+    for ts, off, value in zip(timestamps, offsets, values):
+        key = (math.floor(ts) + off - 1) // 3600 * 3600 - off
+        if blocks and blocks[-1] == key:
+            sums[-1] = sums[-1] + value
+        else:
+            blocks.append(key)
+            sums.append(value)
+
+    return blocks, sums
+
+
+def _zeros(length: int) -> array:
+    return array("d", bytes(8 * length))
+
+
+def _falses(length: int) -> array:
+    return array("B", bytes(length))
+
+
+class IntervalSeries:
+    """Column oriented storage for half-hourly interval data.
+
+    Intervals are not stored, the timestamp (epoch seconds) of interval `idx` is
+    `start + idx * step`. Each metric is a `array('d')` column with a companion
+    `array('B')` validity mask. Invalid (not published) values are stored as 0.
+    Columns can also be read-only views of an IntervalStore, where invalid values
+    are NaN.
+    """
+
+    __slots__ = ("start", "step", "columns", "masks")
+
+    def __init__(
+        self,
+        start: int,
+        columns: dict[str, array],
+        masks: dict[str, array] | None = None,
+        step: int = INTERVAL_LENGTH,
+    ):
+        lengths = {len(x) for x in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError("Lengths of input columns must be the same")
+
+        if masks is None:
+            masks = {name: array("B", [1]) * len(col) for name, col in columns.items()}
+
+        if masks.keys() != columns.keys():
+            raise ValueError("Columns and masks must have the same keys")
+
+        if any(len(masks[name]) != len(col) for name, col in columns.items()):
+            raise ValueError("Columns and masks must have the same length")
+
+        self.start = int(start)
+        self.step = step
+        self.columns = columns
+        self.masks = masks
+
+    @classmethod
+    def from_values(
+        cls,
+        start: int,
+        values: dict[str, Iterable[float | None]],
+        step: int = INTERVAL_LENGTH,
+        engine: str = ENGINE_AUTO,
+    ) -> "IntervalSeries":
+        """Build a series from lists of values where None means not published.
+
+        The numpy and python engines produce identical series, numpy is used if
+        available unless the python engine is requested.
+        """
+        columns = {}
+        masks = {}
+
+        if _use_numpy(engine):
+            for name, column_values in values.items():
+                # None is converted to NaN with a float dtype
+                arr = np.array(column_values, dtype=np.float64)
+                valid = ~np.isnan(arr)
+                arr[~valid] = 0
+                columns[name] = array("d", arr.tobytes())
+                masks[name] = array("B", valid.astype(np.uint8).tobytes())
+
+        else:
+            for name, column_values in values.items():
+                column_values = list(column_values)
+                columns[name] = array(
+                    "d", [x if x is not None else 0 for x in column_values]
+                )
+                masks[name] = array("B", [x is not None for x in column_values])
+
+        return cls(start, columns, masks, step=step)
+
+    @classmethod
+    def empty(cls, start: int = 0, step: int = INTERVAL_LENGTH) -> "IntervalSeries":
+        return cls(start, {}, {}, step=step)
+
+    def __len__(self) -> int:
+        for col in self.columns.values():
+            return len(col)
+
+        return 0
+
+    def __repr__(self) -> str:
+        clsname = self.__class__.__name__
+        return (
+            f"<{clsname} start={self.start} step={self.step} "
+            f"intervals={len(self)} columns={list(self.columns)}>"
+        )
+
+    @property
+    def end(self) -> int:
+        """Timestamp just after the last interval."""
+        return self.start + len(self) * self.step
+
+    def timestamp(self, idx: int) -> int:
+        return self.start + idx * self.step
+
+    def timestamps(self) -> range:
+        return range(self.start, self.end, self.step)
+
+    def datetimes(self, tz: tzinfo) -> list[datetime]:
+        """Aware datetime in `tz` of each interval.
+
+        Equivalent to `datetime.fromtimestamp(ts, tz)` for each timestamp, but only
+        one conversion per day is done unless there is an offset transition on it.
+        """
+        ret: list[datetime] = []
+        block = max(_DATETIMES_BLOCK // self.step, 1)
+        deltas = [timedelta(seconds=n * self.step) for n in range(block)]
+        for idx in range(0, len(self), block):
+            timestamps = range(
+                self.timestamp(idx), self.timestamp(min(idx + block, len(self))), self.step
+            )
+            anchor = datetime.fromtimestamp(timestamps[0], tz)
+            if anchor.utcoffset() == datetime.fromtimestamp(timestamps[-1], tz).utcoffset():
+                # Fixed offset within the block, plain arithmetic from the anchor
+                ret.extend(map(anchor.__add__, deltas[: len(timestamps)]))
+            else:
+                ret.extend(datetime.fromtimestamp(ts, tz) for ts in timestamps)
+
+        return ret
+
+    def index(self, timestamp: int) -> int:
+        """Index of the first interval starting at or after `timestamp`."""
+        idx = math.ceil((timestamp - self.start) / self.step)
+        return min(max(idx, 0), len(self))
+
+    def column(self, name: str) -> array:
+        return self.columns[name]
+
+    def mask(self, name: str) -> array:
+        return self.masks[name]
+
+    def add_column(self, name: str, column: array, mask: array) -> None:
+        if self.columns and (len(column) != len(self) or len(mask) != len(self)):
+            raise ValueError("Lengths of input columns must be the same")
+
+        self.columns[name] = column
+        self.masks[name] = mask
+
+    def add_sum_column(
+        self, name: str, *names: str, engine: str = ENGINE_AUTO
+    ) -> None:
+        """Add column `name` as the sum of `names`, valid if any of them is."""
+        if _use_numpy(engine):
+            column = sum(np.frombuffer(self.columns[x], dtype=np.float64) for x in names)
+            mask = functools.reduce(
+                np.logical_or, (np.frombuffer(self.masks[x], dtype=np.uint8) for x in names)
+            )
+            self.add_column(
+                name,
+                array("d", column.tobytes()),
+                array("B", mask.astype(np.uint8).tobytes()),
+            )
+
+        else:
+            self.add_column(
+                name,
+                array("d", map(sum, zip(*(self.columns[x] for x in names)))),
+                array("B", map(any, zip(*(self.masks[x] for x in names)))),
+            )
+
+    def add_difference_column(
+        self, name: str, minuend: str, subtrahend: str, engine: str = ENGINE_AUTO
+    ) -> None:
+        """Add column `name` as `minuend - subtrahend`, valid if minuend is."""
+        if _use_numpy(engine):
+            column = np.frombuffer(self.columns[minuend], dtype=np.float64) - np.frombuffer(
+                self.columns[subtrahend], dtype=np.float64
+            )
+            self.add_column(name, array("d", column.tobytes()), self.masks[minuend][:])
+
+        else:
+            self.add_column(
+                name,
+                array("d", map(operator.sub, self.columns[minuend], self.columns[subtrahend])),
+                self.masks[minuend][:],
+            )
+
+    def iter_valid(self, name: str) -> Iterator[tuple[int, float]]:
+        """Iterate (timestamp, value) pairs of the valid values of a column."""
+        for ts, value, valid in zip(
+            self.timestamps(), self.columns[name], self.masks[name]
+        ):
+            if valid:
+                yield ts, value
+
+    def last_valid_timestamp(self, *names: str) -> int | None:
+        """Timestamp of the last interval with a valid value in any of `names`."""
+        masks = [self.masks[name] for name in names]
+        for idx in reversed(range(len(self))):
+            if any(mask[idx] for mask in masks):
+                return self.timestamp(idx)
+
+        return None
+
+    def slice(self, start: int | None = None, end: int | None = None) -> "IntervalSeries":
+        """Intervals starting within [start, end)."""
+        idx_start = 0 if start is None else self.index(start)
+        idx_end = len(self) if end is None else self.index(end)
+        idx_end = max(idx_start, idx_end)
+
+        return IntervalSeries(
+            self.timestamp(idx_start),
+            {name: col[idx_start:idx_end] for name, col in self.columns.items()},
+            {name: mask[idx_start:idx_end] for name, mask in self.masks.items()},
+            step=self.step,
+        )
+
+    def merge(self, other: "IntervalSeries") -> "IntervalSeries":
+        """Return a new series with the values from both series.
+
+        Values from `other` replace the ones from `self` for the same interval. Gaps
+        between both series are filled with invalid values.
+        """
+        if not len(other):
+            return self
+
+        if not len(self):
+            return other
+
+        if self.step != other.step or (other.start - self.start) % self.step:
+            raise ValueError("Series are not aligned")
+
+        start = min(self.start, other.start)
+        end = max(self.end, other.end)
+        length = (end - start) // self.step
+
+        columns = {}
+        masks = {}
+        for name in list(self.columns) + [x for x in other.columns if x not in self.columns]:
+            columns[name] = _zeros(length)
+            masks[name] = _falses(length)
+
+            for src in (self, other):
+                if name not in src.columns:
+                    continue
+
+                # Through memoryviews, source columns can be any buffer of doubles
+                offset = (src.start - start) // self.step
+                memoryview(columns[name])[offset : offset + len(src)] = src.columns[name]
+                memoryview(masks[name])[offset : offset + len(src)] = src.masks[name]
+
+        return IntervalSeries(start, columns, masks, step=self.step)
@@ -0,0 +1,120 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import logging
+from datetime import date, datetime
+
+import homeassistant.helpers.config_validation as cv
+import voluptuous as vol
+from homeassistant.core import HomeAssistant, ServiceCall, callback
+from homeassistant.exceptions import HomeAssistantError
+
+from .backfill import BackfillError
+from .const import (
+    ATTR_CONFIG_ENTRY_ID,
+    ATTR_END_DATE,
+    ATTR_START_DATE,
+    DOMAIN,
+    SERVICE_BACKFILL,
+    SERVICE_VERIFY_STATISTICS,
+)
+from .datacoordinator import SynergyCoordinator
+from .laststatistics import async_invalidate_last_statistics
+from .SynergyDataFetcher import SYNERGY_TIMEZONE
+
+_LOGGER = logging.getLogger(__name__)
+
+BACKFILL_SCHEMA = vol.Schema(
+    {
+        vol.Optional(ATTR_CONFIG_ENTRY_ID): cv.string,
+        vol.Required(ATTR_START_DATE): cv.date,
+        vol.Optional(ATTR_END_DATE): cv.date,
+    }
+)
+
+VERIFY_STATISTICS_SCHEMA = vol.Schema(
+    {
+        vol.Optional(ATTR_CONFIG_ENTRY_ID): cv.string,
+    }
+)
+
+
+@callback
+def async_setup_services(hass: HomeAssistant) -> None:
+    async def async_handle_backfill(call: ServiceCall) -> None:
+        start = call.data[ATTR_START_DATE]
+        end = call.data.get(ATTR_END_DATE) or datetime.now(SYNERGY_TIMEZONE).date()
+        if start > end:
+            raise HomeAssistantError(f"{ATTR_START_DATE} must not be after {ATTR_END_DATE}")
+
+        for coordinator in _get_coordinators(hass, call.data.get(ATTR_CONFIG_ENTRY_ID)):
+            # Backfills can take a while, don't block the service call
+            hass.async_create_background_task(
+                _async_backfill(coordinator, start, end),
+                f"{DOMAIN} backfill {start} → {end}",
+            )
+
+    async def async_handle_verify_statistics(call: ServiceCall) -> None:
+        for coordinator in _get_coordinators(hass, call.data.get(ATTR_CONFIG_ENTRY_ID)):
+            for sensor in coordinator.sensors:
+                if hasattr(sensor, "async_verify_statistics"):
+                    await sensor.async_verify_statistics(full=True)
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_BACKFILL, async_handle_backfill, schema=BACKFILL_SCHEMA
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_VERIFY_STATISTICS,
+        async_handle_verify_statistics,
+        schema=VERIFY_STATISTICS_SCHEMA,
+    )
+
+
+def _get_coordinators(
+    hass: HomeAssistant, entry_id: str | None
+) -> list[SynergyCoordinator]:
+    entries = [
+        entry
+        for entry in hass.config_entries.async_entries(DOMAIN)
+        if entry.entry_id in hass.data.get(DOMAIN, {})
+        and (entry_id is None or entry.entry_id == entry_id)
+    ]
+    if not entries:
+        raise HomeAssistantError(f"No loaded {DOMAIN} entry found")
+
+    return [hass.data[DOMAIN][entry.entry_id][0] for entry in entries]
+
+
+async def _async_backfill(coordinator: SynergyCoordinator, start: date, end: date) -> None:
+    try:
+        await coordinator.async_backfill(start, end)
+
+    except BackfillError as e:
+        _LOGGER.error(f"backfill {start} → {end} incomplete, call it again to resume: {e}")
+
+    except Exception:  # pylint: disable=broad-except
+        _LOGGER.exception(f"backfill {start} → {end} failed")
+
+    else:
+        _LOGGER.info(f"backfill {start} → {end} completed")
+
+    finally:
+        # Statistics of backfilled days were imported out of order
+        for sensor in coordinator.sensors:
+            async_invalidate_last_statistics(coordinator.hass, sensor.entity_id)
@@ -0,0 +1,68 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import logging
+from typing import Any
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+
+from .const import DOMAIN, STORAGE_SAVE_DELAY, STORAGE_VERSION
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class SynergyStorage:
+    """Per config entry persistent state.
+
+    Every component keeps its own key. Writes are delayed and coalesced into a
+    single file write.
+    """
+
+    def __init__(self, hass: HomeAssistant, entry_id: str):
+        # Private: session cookies are stored here
+        self._store: Store[dict[str, Any]] = Store(
+            hass, STORAGE_VERSION, f"{DOMAIN}.{entry_id}", private=True
+        )
+        self._data: dict[str, Any] = {}
+
+    async def async_load(self) -> None:
+        self._data = await self._store.async_load() or {}
+        _LOGGER.debug(f"loaded {', '.join(self._data) or 'nothing'} from storage")
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._data.get(key, default)
+
+    def set(self, key: str, value: Any) -> None:
+        self._data[key] = value
+        self._store.async_delay_save(self._data_to_save, STORAGE_SAVE_DELAY)
+
+    def pop(self, key: str) -> None:
+        if self._data.pop(key, None) is not None:
+            self._store.async_delay_save(self._data_to_save, STORAGE_SAVE_DELAY)
+
+    async def async_flush(self) -> None:
+        """Write now, replacing any delayed write (ex. before unloading)."""
+        await self._store.async_save(self._data)
+
+    async def async_remove(self) -> None:
+        self._data = {}
+        await self._store.async_remove()
+
+    def _data_to_save(self) -> dict[str, Any]:
+        return self._data